@@ -0,0 +1,461 @@
+#! /usr/bin/env python3
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import traceback
+import numpy as np
+from astropy.io import ascii as asciitable
+from astropy.table import Table, vstack
+
+import datahandling
+import timeseries
+from datahandling import INPUTDIR
+
+SOURCE = 'JohnHopkins'
+STATS = ['confirmed', 'deaths', 'recovered']
+
+def timeit(func, *args, repeat=1, **kwargs):
+    best = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def report(name, old, new, same=None):
+    line = '{:<24} {:10.4f} s {:10.4f} s {:8.1f}×'.format(name, old, new,
+                old / new)
+    if same is not None:
+        line += '   same output: {}'.format('yes' if same else 'NO')
+    print(line)
+    # a different output fails the benchmark
+    return same is not False
+
+def same_table(tab1, tab2):
+    if tab1.colnames != tab2.colnames or len(tab1) != len(tab2):
+        return False
+    return all(tab1[n].tolist() == tab2[n].tolist() for n in tab1.colnames)
+
+def load_tables():
+    # the bundled JohnHopkins global series
+    filenames = ['covid-19-{}.csv'.format(s) for s in STATS]
+    return [datahandling.read_table(os.path.join(INPUTDIR, f)) 
+                for f in filenames]
+
+def zone_tables():
+    tables = [datahandling._fix_colnames(t) for t in load_tables()]
+    tables = [datahandling._convert_to_daily(t, SOURCE) for t in tables]
+    return [datahandling._sum_zones(t, SOURCE) for t in tables]
+
+def merged_table():
+    return datahandling._merge_tables(zone_tables(), SOURCE)
+
+def daily_by_column(tab):
+    # previous differencing: one new column per date
+    cols = datahandling._date_columns(tab)
+    for c2, c1 in zip(cols[-1:1:-1], cols[-2:0:-1]):
+        tab[c2] -= tab[c1]
+    return tab
+
+def bench_daily(repeat=1):
+    tables = [datahandling._fix_colnames(t) for t in load_tables()]
+    old, ref = timeit(lambda: [daily_by_column(t.copy()) for t in tables])
+    new, res = timeit(lambda: [datahandling._convert_to_daily(t.copy(), 
+                    SOURCE) for t in tables], repeat=repeat)
+    return report('_convert_to_daily', old, new, 
+                all(map(same_table, ref, res)))
+
+def sum_zones_by_country(tab):
+    # previous region summing: full-table masks and one add_row per country
+    for country in np.unique(tab['country']):
+        same_country = tab['country'] == country
+        is_region = tab['region'].mask == False
+        is_global = np.logical_and(np.logical_not(is_region), same_country)
+        if any(is_global):
+            tab['region'][is_global] = 'all'
+            continue
+        is_region = np.logical_and(is_region, same_country)
+        if not any(is_region):
+            continue
+        regions = tab[is_region] 
+        row = ['all', country]
+        datacols = datahandling._date_columns(tab)
+        row += [np.sum(regions[col]) for col in datacols]
+        tab.add_row(row)    
+    return tab
+
+def bench_sum_zones(repeat=1):
+    tables = [datahandling._fix_colnames(t) for t in load_tables()]
+    tables = [datahandling._convert_to_daily(t, SOURCE) for t in tables]
+    old, ref = timeit(lambda: [sum_zones_by_country(t.copy()) 
+                    for t in tables])
+    new, res = timeit(lambda: [datahandling._sum_zones(t.copy(), SOURCE) 
+                    for t in tables], repeat=repeat)
+    return report('_sum_zones', old, new, all(map(same_table, ref, res)))
+
+def bench_fix_date(repeat=1):
+    tab = merged_table()
+    old, ref = timeit(datahandling._fix_date, tab, SOURCE, columnar=False)
+    new, res = timeit(datahandling._fix_date, tab, SOURCE, repeat=repeat)
+    return report('_fix_date', old, new, same_table(ref, res))
+
+def scan_zones(tab):
+    # previous zone iteration: a full-table mask for every (country, region)
+    for country in np.unique(tab['country']):
+        for region in np.unique(tab['region']):
+            zone = datahandling._select_zone(tab, country, region)
+            if len(zone):
+                yield zone
+
+def index_zones(tab):
+    return list(datahandling._iterzone(tab))
+
+def bench_zones(repeat=1):
+    tab = merged_table()
+    old, ref = timeit(lambda t: list(scan_zones(t)), tab)
+    new, res = timeit(index_zones, tab, repeat=repeat)
+    same = len(ref) == len(res) and all(map(same_table, ref, res))
+    ok = report('zone grouping', old, new, same)
+    # rebuild time should scale with the number of rows
+    for n in [1, 2, 4]:
+        big = vstack([tab] * n)
+        t, res = timeit(index_zones, big, repeat=repeat)
+        print('    {:6} rows: {:.4f} s'.format(len(big), t))
+    return ok
+
+def merge_by_row(tables):
+    # previous merge: zone lookup per row and date parsing per cell
+    colnames = ('date', 'cases', 'deaths',
+                'recoveries', 'country', 'region', 
+                'country_code_3', 'country_code_2', 'population')
+    rows = []
+    cases, deaths, recov = tables
+    for row_c in cases:
+        region, country = row_c['region'], row_c['country']
+        row_d = datahandling._select_zone(deaths, country, region)
+        row_r = datahandling._select_zone(recov, country, region)
+        for usdate in cases.colnames:
+            if not re.match(datahandling._US_DATE_RE, usdate):
+                continue
+            num_cases = row_c[usdate]
+            num_recov = 0
+            num_deaths = 0
+            if len(row_d) and usdate in row_d.columns:
+                num_deaths = row_d[usdate].item()
+            if len(row_r) and usdate in row_r.columns:
+                num_recov = row_r[usdate].item()
+            row = (usdate, num_cases, num_deaths, num_recov, 
+                    country, region, '   ', '  ', 0)
+            rows.append(row)
+    return Table(rows=rows, names=colnames)
+
+def bench_merge(repeat=1):
+    tables = zone_tables()
+    old, ref = timeit(merge_by_row, tables)
+    new, res = timeit(datahandling._merge_tables, tables, SOURCE,
+                    repeat=repeat)
+    return report('_merge_tables', old, new, same_table(ref, res))
+
+def fix_country_by_row(tab):
+    # previous country fixes: one pycountry lookup per row
+    import pycountry
+    for row in tab:
+        country = row['country']
+        name, lookup = datahandling.COUNTRY_ALIASES.get(country, 
+                            (country, country))
+        row['country'] = name
+        c = pycountry.countries.get(name=lookup)
+        if c:
+            row['country_code_2'] = c.alpha_2
+            row['country_code_3'] = c.alpha_3
+    return tab
+
+def bench_fix_country(repeat=1):
+    tab = datahandling._fix_date(merged_table(), SOURCE)
+    old, ref = timeit(fix_country_by_row, tab.copy())
+    new = np.inf
+    for i in range(repeat):
+        # a new resolver each time, so that its lookups are timed
+        resolver = datahandling.CountryResolver()
+        t, res = timeit(datahandling._fix_country, tab.copy(), SOURCE,
+                    resolver=resolver)
+        new = min(new, t)
+    return report('_fix_country', old, new, same_table(ref, res))
+
+def read_input_dir(reader):
+    return [reader(os.path.join(INPUTDIR, f)) 
+                for f in sorted(os.listdir(INPUTDIR))]
+
+def bench_read(repeat=1):
+    old, ref = timeit(read_input_dir, asciitable.read)
+    new, res = timeit(read_input_dir, 
+                    lambda f: datahandling.read_table(f, cache=False),
+                    repeat=repeat)
+    return report('read ' + INPUTDIR + '/', old, new, 
+                all(map(same_table, ref, res)))
+
+def read_region_by_parsing(region, date):
+    # previous region loading: all files parsed again for every region
+    filename = os.path.join(INPUTDIR, 'SemanasEpidemiologicas.csv')
+    weeks = datahandling.read_table(filename, cache=False).columns[1:]
+    weeks = {n: v[0] for n, v in weeks.items()}
+    inicio = datahandling._symptom_filename(date)
+    tabs = []
+    for name in ['CasosAcumuladosPorComuna.csv', 'CasosActivosPorComuna.csv', 
+                 inicio]:
+        filename = os.path.join(INPUTDIR, name)
+        tab = datahandling.read_table(filename, cache=False)
+        tab = tab[tab['Codigo region'] == region]
+        tab = tab[tab['Comuna'] != 'Total']
+        if name == inicio:
+            names = [weeks.get(c, c) for c in tab.colnames]
+            tab = Table(rows=tab, names=names)
+        tabs.append(tab)
+    return tabs
+
+def read_all_regions(reader, date=None):
+    return [reader(region, date) for region in range(1, 17)]
+
+def bench_regions(repeat=1):
+    date = None
+    old, ref = timeit(read_all_regions, read_region_by_parsing, date)
+    datahandling.TABLE_CACHE.clear()
+    new, res = timeit(read_all_regions, datahandling.read_chilean_region, 
+                    date)
+    same = all(same_table(t1, t2) for r1, r2 in zip(ref, res) 
+                                  for t1, t2 in zip(r1, r2))
+    return report('16 regions', old, new, same)
+
+def country_series(tab, **kwargs):
+    return [datahandling.get_country_data(tab, country, var, **kwargs)
+                for country in np.unique(tab['country'])
+                for var in ['cases', 'deaths', 'recoveries']]
+
+def bench_series(repeat=1):
+    tab = processed_table()
+    zones = datahandling.ZoneIndex(tab)
+    old, ref = timeit(country_series, tab, zones=zones)
+    start = time.perf_counter()
+    series = datahandling.SeriesStore(tab, zones=zones)
+    build = time.perf_counter() - start
+    new, res = timeit(country_series, tab, series=series, repeat=repeat)
+    same = all(np.array_equal(a, b) for r1, r2 in zip(ref, res) 
+                                    for a, b in zip(r1, r2))
+    return report('get_country_data', old, new + build, same)
+
+def aligned_by_country(series, countries, nbin=7, origin=50):
+    return [datahandling.get_country_data(None, c, 'cases', nbin=nbin,
+                date_origin=origin, series=series) for c in countries]
+
+def aligned_by_kernels(series, countries, nbin=7, origin=50):
+    dates = np.array([series.get(c, 'cases')[0] for c in countries])
+    values = np.array([series.get(c, 'cases')[1] for c in countries])
+    days = timeseries.days_since(timeseries.cumulated(values), origin, dates)
+    return days[:,nbin-1:], timeseries.binned(values, nbin)
+
+def bench_kernels(repeat=1):
+    tab = processed_table()
+    series = datahandling.SeriesStore(tab)
+    countries = np.unique(tab['country'])
+    old, ref = timeit(aligned_by_country, series, countries)
+    new, (days, binned) = timeit(aligned_by_kernels, series, countries, 
+                repeat=repeat)
+    # series whose cumulated cases decrease are aligned differently (on
+    # their first crossing of the threshold) and are not compared
+    values = np.array([series.get(c, 'cases')[1] for c in countries])
+    monotone = (np.diff(values.cumsum(axis=1), axis=1) >= 0).all(axis=1)
+    same = all(np.isnan(d).all() if not len(r) else
+                    np.allclose(d, r) and np.array_equal(b, v)
+                for (r, v), d, b, m in zip(ref, days, binned, monotone) if m)
+    return report('binning and alignment', old, new, same)
+
+def processed_table():
+    tables = [datahandling._fix_colnames(t) for t in load_tables()]
+    return datahandling._process_tables(tables, SOURCE)
+
+def bench_cube(repeat=1):
+    old, tab = timeit(processed_table)
+    tables = [datahandling._fix_colnames(t) for t in load_tables()]
+    new, cube = timeit(datahandling._cube_from_wide, tables, repeat=repeat)
+    ok = report('international data set', old, new, 
+                same_table(tab, cube.table()))
+    size = sum(tab[n].nbytes for n in tab.colnames)
+    print('    table: {:.1f} MB, cube: {:.1f} MB'.format(size / 2**20,
+                cube.nbytes / 2**20))
+    return ok
+
+def vital_tables(years):
+    return [datahandling.read_table(os.path.join(INPUTDIR, 
+                'death-{}.csv'.format(year))) for year in years]
+
+def bench_vitals(repeat=1, binsize=14):
+    # binning of the deaths of 2010-2020 from the tables and from the cube
+    import defunciones
+    years = list(range(2010, 2021))
+    tabs = vital_tables(years)
+    def by_table():
+        return [defunciones.get_vital(year, binsize=binsize, tab=tab)
+                    for year, tab in zip(years, tabs)]
+    def by_cube(cube):
+        return [defunciones.get_vital(year, binsize=binsize, cube=cube)
+                    for year in years]
+    old, binned = timeit(by_table)
+    build, cube = timeit(datahandling._vitals_cube, tabs, years)
+    new, res = timeit(by_cube, cube, repeat=repeat)
+    same = all((c1 == c2).all() and (w1 == w2).all() and np.allclose(v1, v2)
+                for (c1, w1, v1), (c2, w2, v2) in zip(binned, res))
+    ok = report('bin vitals', old, new, same)
+    print('    cube built in {:.3f} s, {:.1f} MB'.format(build, 
+                cube.nbytes / 2**20))
+    return ok
+
+def excess_by_region(tabs, years, binsize=14):
+    # previous way: binning and correction of each region in turn
+    import defunciones
+    excess = []
+    for region in range(1, 17):
+        population = defunciones.populations(years, region=region)
+        binned = [defunciones.get_vital(year, region=region, 
+                    binsize=binsize, tab=tab) for year, tab in zip(years, tabs)]
+        past_dates, past_widths, past_values = zip(*binned[:-1])
+        past_mortality = np.array([v / population[y] 
+                    for y, v in zip(years, past_values)])
+        corr = defunciones.mortality_rate_correction(np.array(years[:-1]),
+                    past_widths, past_values, population=population)
+        past_mortality *= corr[:,None]
+        dates, widths, values = binned[-1]
+        present = dates, widths, values / population[years[-1]]
+        excess.append(defunciones.excess_deaths(present, past_mortality,
+                    population[years[-1]])[4])
+    return np.array(excess)
+
+def bench_excess(repeat=1, binsize=14):
+    # excess deaths of the 16 regions, and of all comunas for the new way
+    import defunciones
+    years = list(range(2010, 2021))
+    tabs = vital_tables(years)
+    old, res = timeit(excess_by_region, tabs, years, binsize=binsize)
+    cube = datahandling._vitals_cube(tabs, years)
+    new, tab = timeit(defunciones.excess_table, binsize=binsize, cube=cube,
+                    repeat=repeat)
+    same = np.allclose(tab['excess'][tab['level'] == 'region'], res)
+    return report('excess by region', old, new, same)
+
+def render_pages(render, npages):
+    for page in range(npages):
+        fig = render(page)
+        fig.canvas.draw()
+
+def bench_render(repeat=1, region=13):
+    # per page time to draw the comuna graphs of the Metropolitan region
+    import matplotlib
+    matplotlib.use('Agg')
+    import chilean_cases_by_comuna as comunas
+    tabs = datahandling.read_chilean_region(region, None)
+    data = comunas.region_arrays(tabs)
+    nrows, ncols, npages = comunas.page_grid(len(tabs[0]))
+    old, res = timeit(render_pages,
+                lambda p: comunas.plot_page(data, nrows, ncols, p), npages)
+    grid = comunas.page_template(nrows, ncols)
+    new, res = timeit(render_pages, lambda p: grid.draw(data, p), npages,
+                repeat=repeat)
+    return report('render page', old / npages, new / npages)
+
+# script modules, their import time budget (s) on top of the one of the
+# astropy tables they all need, the least number of timings of which the 
+# best is kept, and the modules they should only import when needed (the
+# budget is loose as timings vary a lot, these are checked separately)
+IMPORT_BUDGET = 0.25
+IMPORT_RUNS = 5
+SCRIPTS = ['datahandling', 'chilean_cases_by_comuna', 'compare_countries',
+           'country_stat', 'totales', 'curacavi', 'vitals', 'defunciones',
+           'export', 'timeseries']
+LAZY_MODULES = ['matplotlib.pyplot', 'matplotlib.pylab', 'scipy', 'pycountry']
+
+def import_time(module):
+    # cumulative import time reported by python -X importtime and the lazy
+    # modules that were imported anyway
+    code = 'import sys, {}; print(*[m for m in {!r} if m in sys.modules])'
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 
+                code.format(module, LAZY_MODULES)], capture_output=True,
+                text=True, check=True, 
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+    last = [l for l in out.stderr.splitlines() 
+                if l.startswith('import time:')][-1]
+    cumulated = int(last.split('|')[1])
+    return cumulated * 1e-6, out.stdout.split()
+
+def bench_imports(repeat=1, budget=IMPORT_BUDGET):
+    # the astropy tables are timed along with each module, so that both
+    # see the same load of the machine, after a run warming the disk cache
+    ok = True
+    runs = max(repeat, IMPORT_RUNS)
+    for module in ['astropy.table'] + SCRIPTS:
+        import_time(module)
+    for module in SCRIPTS:
+        base, times, loaded = [], [], []
+        for i in range(runs):
+            base.append(import_time('astropy.table')[0])
+            t, l = import_time(module)
+            times.append(t)
+            loaded.append(l)
+        line = '    {:<28} {:.3f} s (astropy.table {:.3f} s)'.format(module, 
+                    min(times), min(base))
+        if min(times) > min(base) + budget:
+            line += '   over budget ({:.3f} s)'.format(min(base) + budget)
+            ok = False
+        if loaded[0]:
+            line += '   imports ' + ', '.join(loaded[0])
+            ok = False
+        print(line)
+    return ok
+
+BENCHMARKS = {
+    'daily': bench_daily,
+    'sum_zones': bench_sum_zones,
+    'fix_date': bench_fix_date,
+    'zones': bench_zones,
+    'merge': bench_merge,
+    'fix_country': bench_fix_country,
+    'read': bench_read,
+    'regions': bench_regions,
+    'series': bench_series,
+    'kernels': bench_kernels,
+    'cube': bench_cube,
+    'vitals': bench_vitals,
+    'excess': bench_excess,
+    'render': bench_render,
+    'imports': bench_imports,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        'Time the data processing steps against their previous implementation'
+        ' on the bundled input files'
+    )
+    parser.add_argument('-b', '--benchmark', action='append',
+        dest='benchmarks', choices=list(BENCHMARKS), default=[],
+        help='benchmark to run (may be repeated, by default: all)'
+    )
+    parser.add_argument('--repeat', type=int, default=3,
+        help='number of timings of the new implementation (best is kept)'
+    )
+    arg = parser.parse_args()
+    print('{:<24} {:>12} {:>12} {:>9}'.format('step', 'before', 'after',
+        'speed-up'))
+    # a benchmark returning False or raising an error failed
+    failed = []
+    for name in arg.benchmarks or BENCHMARKS:
+        try:
+            if BENCHMARKS[name](repeat=arg.repeat) is False:
+                failed.append(name)
+        except Exception:
+            traceback.print_exc()
+            failed.append(name)
+    if failed:
+        print('failed:', ', '.join(failed))
+        sys.exit(1)
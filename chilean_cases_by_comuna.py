@@ -1,14 +1,14 @@
 #! /usr/bin/env python3
 
-from astropy.table import Table
-from matplotlib import pylab as plt
-from matplotlib.backends.backend_pdf import PdfPages
+from astropy.table import Table, vstack
 import numpy as np
 import argparse
 import sys
 import os
-from scipy.stats import linregress
-from datahandling import retrieve_chilean_region
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from datahandling import retrieve_chilean_region, retrieve_chilean_data
+from datahandling import read_chilean_region, OUTPUTDIR
 import __main__
 
 GRAPHICSDIR = "graphics"
@@ -23,85 +23,174 @@ class PlotStyle(object):
         self._style = style
         self._object = None
     def __enter__(self):
+        from matplotlib import pyplot as plt
         if self._style == 'xkcd':
             self._object = plt.xkcd()
         else:
             self._object = plt.style.context(self._style)
-        return self._object
+        return self._object.__enter__()
     def __exit__(self, *args):
-        pass
+        return self._object.__exit__(*args)
 
-def display_trend(ax, dates, values, threshold=10):
-    if min(values) < 1 or max(values) < threshold:
-        return ''
-    x = (dates - dates[0]) / DAY 
-    y = np.log2(values)
-    a, b, *unused = linregress(x, y)
-    x = np.arange(dates[0], NOW, HOUR)   
-    y = 2**(b + a * (x-x[0]) / DAY)
-    ax.plot(x, y, 'k--', zorder=2)
-    if abs(a) >= 1/60:
-        return f" {'×' if a>0 else '/'}2 en {1/abs(a):.2g} días"
+def fit_trends(dates, values, threshold=10):
+    # log2-linear least squares fit of each row of values (comunas × dates),
+    # not done (valid = False) for small or vanishing numbers of cases
+    x = (np.asarray(dates) - dates[0]) / DAY
+    values = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan)
+    valid = np.all(np.isfinite(values), axis=1)
+    valid[valid] = ((values[valid].min(axis=1) >= 1)
+                    & (values[valid].max(axis=1) >= threshold))
+    y = np.log2(np.where(valid[:,None], values, 1))
+    dx = x - x.mean()
+    slope = (y * dx).sum(axis=1) / (dx ** 2).sum()
+    intercept = y.mean(axis=1) - slope * x.mean()
+    return slope, intercept, valid
+
+def trend_text(slope):
+    if abs(slope) >= 1/60:
+        return f" {'×' if slope>0 else '/'}2 en {1/abs(slope):.2g} días"
     else:
         return ' ≃ estable'
 
-def plot_page(tabs, nrows=7, ncols=4, page=0, trend=False):
+def display_trend(ax, dates, values, threshold=10, fit=None):
+    if fit is None:
+        fit = [p[0] for p in fit_trends(dates, [values], threshold=threshold)]
+    a, b, valid = fit
+    if not valid:
+        return ''
+    ax.plot(*trend_curve(dates, fit), 'k--', zorder=2)
+    return trend_text(a)
+
+def trend_curve(dates, fit):
+    # fitted exponential sampled daily from the first date until now
+    a, b, valid = fit
+    x = np.append(np.arange(dates[0], NOW, DAY), NOW)
+    y = 2**(b + a * (x-x[0]) / DAY)
+    return x, y
+
+def _series(tab, first=5, last=None):
+    # comunas × dates array of a comuna table, masked values as NaN
+    cols = [tab[c] for c in tab.colnames[first:last]]
+    return np.ma.filled(np.ma.array(cols, dtype=float), np.nan).T
+
+def trend_table(tabs, threshold=10, ndates=4):
+    # doubling times (days, negative when halving) of total and active cases
+    tab_t, tab_a = tabs[0], tabs[1]
+    dates_t = np.array(tab_t.colnames[5:-1], dtype='datetime64[D]')
+    dates_a = np.array(tab_a.colnames[5:], dtype='datetime64[D]')
+    tab = tab_t['Region', 'Codigo region', 'Comuna', 'Codigo comuna']
+    for name, dates, values in [('total', dates_t, _series(tab_t, 5, -1)), 
+                                ('active', dates_a, _series(tab_a, 5))]:
+        slope, intercept, valid = fit_trends(dates[-ndates:], 
+                    values[:,-ndates:], threshold=threshold)
+        with np.errstate(divide='ignore'):
+            doubling = 1 / slope
+        tab[name] = values[:,-1]
+        tab['doubling time ' + name] = np.ma.array(doubling, mask=~valid)
+    return tab
+
+def region_arrays(tabs, ndates=4):
+    # comuna tables as dense arrays (comunas × report dates), computed once
+    # for all pages of a region
     (tab_t, tab_a, tab_s) = tabs
-    dates_t = [np.datetime64(d) for d in tab_t.colnames[5:-1]]
-    dates_a = [np.datetime64(d) for d in tab_a.colnames[5:]]
-    dates_s = [np.datetime64(d) for d in tab_s.colnames[5:]]
+    poblacion = np.ma.asarray(tab_t['Poblacion'], dtype=float)
+    data = dict(
+        ncomunas=min(len(tab) for tab in tabs),
+        comuna=np.array(tab_t['Comuna']),
+        poblacion=np.ma.filled(poblacion, np.nan),
+        has_poblacion=~np.ma.getmaskarray(poblacion),
+        dates_t=np.array(tab_t.colnames[5:-1], dtype='datetime64[D]'),
+        dates_a=np.array(tab_a.colnames[5:], dtype='datetime64[D]'),
+        dates_s=np.array(tab_s.colnames[5:], dtype='datetime64[D]'),
+        cases_t=_series(tab_t, 5, -1),
+        cases_a=_series(tab_a, 5),
+    )
+    # trends from the last reports
+    for s in 'ta':
+        dates, cases = data['dates_' + s][-ndates:], data['cases_' + s]
+        fit = fit_trends(dates, cases[:,-ndates:])
+        data['fit_' + s] = list(zip(*fit))
+    return data
+
+def _max_per_mil(data):
+    # largest last number of total cases, in absolute and per mil
+    has_poblacion = data['has_poblacion']
+    last_t = data['cases_t'][has_poblacion,-1]
+    maxcases = np.nanmax(last_t)
+    maxperm = np.nanmax(1000 * last_t / data['poblacion'][has_poblacion])
+    return maxcases, maxperm
+
+def _yscales(poblacion, maxperm, ymin=0.2):
+    # limits, symlog thresholds, and ticks of the absolute and ‰ y-axes
+    ymax = maxperm * poblacion / 1000
+    y2max = 1.2 * maxperm
+    y2min = 1000 * ymin / poblacion
+    yt = np.array([1, 10, 100, 1000, 10000])
+    yt = yt[(ymin <= yt)*(yt <= ymax)]
+    y2t = np.array([.01, .1, 1, 10, 100])
+    y2t = y2t[(y2min <= y2t)*(y2t <= y2max)]
+    return (ymin, ymax, yt), (y2min, y2max, y2t)
+
+def _case_labels(ct, ca):
+    pt, pa = ct > 1, ca > 1
+    text_t = f"{ct:.0f} caso{'s' if pt else ''} total{'es' if pt else ''}"
+    text_a = f"{ca:.0f} caso{'s' if pa else ''} activo{'s' if pa else ''}" 
+    return text_t, text_a
+
+def _page_rows(data, nrows, ncols, page):
+    # comunas with a known population displayed on a page
+    naxes = nrows * ncols
+    rows = np.arange(page*naxes, min((page+1)*naxes, data['ncomunas']))
+    return rows[data['has_poblacion'][rows]]
+
+def page_grid(ncomunas):
+    # plot dimensions 2 x 6 or smaller if fits in one page
+    ncols = 2
+    nrows = min(6, int(np.ceil(ncomunas/ncols)))
+    naxes = nrows * ncols
+    npages = 1 + (ncomunas - 1)//naxes 
+    return nrows, ncols, npages
+
+def _date_labels(xlabels):
+    return [str(d)[-2:] + "/" + str(d)[-5:-3] for d in xlabels]
+
+def plot_page(data, nrows=7, ncols=4, page=0, trend=False):
+    from matplotlib import pyplot as plt
+    dates_t, dates_a, dates_s = data['dates_t'], data['dates_a'], data['dates_s']
     xlabels = np.arange(dates_s[0], TOMORROW)[::14]
     naxes = nrows * ncols
-    maxcases = max(r[-2] for r in tab_t
-                        if r['Poblacion'] is not np.ma.masked)
-    maxperm = max(1000 * r[-2] / r['Poblacion'] for r in tab_t
-                        if r['Poblacion'] is not np.ma.masked)
+    maxcases, maxperm = _max_per_mil(data)
     # plot data
     fig = plt.figure(1 + page, figsize=(8.5,11))    
     fig.clf()
     axes = fig.subplots(nrows, ncols, sharex=False, sharey=False)
     k = 0
-    for (row_t, row_a, row_s) in zip(
-            tab_t[page*naxes:(page+1)*naxes],
-            tab_a[page*naxes:(page+1)*naxes],
-            tab_s[page*naxes:(page+1)*naxes]):
-        cases_t = list(row_t)[5:-1]
-        cases_a = list(row_a)[5:]
-        poblacion = row_t['Poblacion']
-        comuna = row_t['Comuna']
-        if poblacion is np.ma.masked:
-            continue
+    for j in _page_rows(data, nrows, ncols, page):
+        cases_t, cases_a = data['cases_t'][j], data['cases_a'][j]
+        fit_t, fit_a = data['fit_t'][j], data['fit_a'][j]
+        poblacion = data['poblacion'][j]
+        comuna = data['comuna'][j]
         ax = axes[k // ncols][k % ncols]
         print(comuna, dates_t[-1], cases_t[-1])
         # no x
         ax.set_xlim(dates_s[0], TOMORROW)
         ax.set_xticks([])
         # set the absolute yscale
-        y2max = 1.2 * maxperm
-        ymax = maxperm * poblacion / 1000
-        ymin = 0.2
-        y2min = 1000 * ymin / poblacion
+        (ymin, ymax, yt), (y2min, y2max, y2t) = _yscales(poblacion, maxperm)
         ax.set_ylim(0, ymax)
-        ax.set_yscale('symlog', linthreshy=ymin)
-        yt = np.array([1, 10, 100, 1000, 10000])
-        yt = yt[(ymin <= yt)*(yt <= ymax)]
+        ax.set_yscale('symlog', linthresh=ymin)
         ax.set_yticks(yt)
         ax.set_yticklabels([str(y) for y in yt])
         # set the % yscale
         ax2 = ax.twinx()
         ax2.set_ylim(0, y2max)
-        ax2.set_yscale('symlog', linthreshy=y2min)
-        yt = np.array([.01, .1, 1, 10, 100])
-        yt = yt[(y2min <= yt)*(yt <= y2max)]
-        ax2.set_yticks(yt)
-        ax2.set_yticklabels([f"{y:.4g}‰" for y in yt])
+        ax2.set_yscale('symlog', linthresh=y2min)
+        ax2.set_yticks(y2t)
+        ax2.set_yticklabels([f"{y:.4g}‰" for y in y2t])
         # plot trends
-        ct, ca = cases_t[-1], cases_a[-1]
-        pt, pa = ct > 1, ca > 1
-        text_t = f"{ct:.0f} caso{'s' if pt else ''} total{'es' if pt else ''}"
-        text_t += display_trend(ax, dates_t[-4:], cases_t[-4:], threshold=10)
-        text_a = f"{ca:.0f} caso{'s' if pa else ''} activo{'s' if pa else ''}" 
-        text_a += display_trend(ax, dates_a[-4:], cases_a[-4:], threshold=10)
+        text_t, text_a = _case_labels(cases_t[-1], cases_a[-1])
+        text_t += display_trend(ax, dates_t[-4:], cases_t[-4:], fit=fit_t)
+        text_a += display_trend(ax, dates_a[-4:], cases_a[-4:], fit=fit_a)
         # plot data
         ax.plot(dates_t, cases_t, 'o', mfc=(.5,.5,.5), mec=(.3,.3,.3), ms=3,
             label=text_t, zorder=1)
@@ -120,36 +209,176 @@ def plot_page(tabs, nrows=7, ncols=4, page=0, trend=False):
         # set the dates
         ax = axes[j // ncols][j % ncols]
         ax.set_xticks(xlabels)
-        xl = [str(d)[-2:] + "/" + str(d)[-5:-3] for d in xlabels]
-        ax.set_xticklabels(xl, rotation=75, ha='right')
+        ax.set_xticklabels(_date_labels(xlabels), rotation=75, ha='right')
         
     fig.tight_layout(pad=2)
     fig.subplots_adjust(hspace=0)
     return fig
 
-def plot_region(region, filename=None, trend=False, overwrite=False, date=None):
+class PageTemplate(object):
+    # a page of nrows × ncols comuna graphs whose axes, twin axes, lines,
+    # legends, and layout are built once and updated for each page drawn
+    def __init__(self, nrows, ncols):
+        from matplotlib import pyplot as plt
+        self.nrows, self.ncols = nrows, ncols
+        self.fig = plt.figure('template {}x{}'.format(nrows, ncols), 
+                    figsize=(8.5,11))
+        self.fig.clf()
+        axes = self.fig.subplots(nrows, ncols, sharex=False, sharey=False,
+                    squeeze=False)
+        self.cells = [self._cell(ax) for ax in axes.ravel()]
+        self._layout = False
+    def _cell(self, ax):
+        ax.set_yscale('symlog', linthresh=0.2)
+        ax2 = ax.twinx()
+        trend_t, = ax.plot([], [], 'k--', zorder=2)
+        trend_a, = ax.plot([], [], 'k--', zorder=2)
+        data_t, = ax.plot([], [], 'o', mfc=(.5,.5,.5), mec=(.3,.3,.3), ms=3,
+            label=' ', zorder=1)
+        data_a, = ax.plot([], [], 'o', mfc=(.5,.5,.9), mec=(.3,.3,.9), ms=3,
+            label=' ', zorder=1)
+        legend = ax.legend(fontsize=9, loc=3, fancybox=False, 
+            labelspacing=.3, handletextpad=0, handlelength=1.2, frameon=False)
+        name = ax.text(0.03, 0.97, '', 
+                va='top', transform=ax.transAxes, fontsize=10)
+        return dict(ax=ax, ax2=ax2, trend_t=trend_t, trend_a=trend_a,
+                data_t=data_t, data_a=data_a, legend=legend.get_texts(),
+                name=name)
+    def _update(self, cell, data, j, maxperm):
+        dates_t, dates_a = data['dates_t'], data['dates_a']
+        cases_t, cases_a = data['cases_t'][j], data['cases_a'][j]
+        ax, ax2 = cell['ax'], cell['ax2']
+        print(data['comuna'][j], dates_t[-1], cases_t[-1])
+        ax.set_xlim(data['dates_s'][0], TOMORROW)
+        (ymin, ymax, yt), (y2min, y2max, y2t) = _yscales(
+                    data['poblacion'][j], maxperm)
+        ax.set_ylim(0, ymax)
+        ax.set_yticks(yt)
+        ax.set_yticklabels([str(y) for y in yt])
+        ax2.set_yscale('symlog', linthresh=y2min)
+        ax2.set_ylim(0, y2max)
+        ax2.set_yticks(y2t)
+        ax2.set_yticklabels([f"{y:.4g}‰" for y in y2t])
+        labels = _case_labels(cases_t[-1], cases_a[-1])
+        for s, dates, cases, label, text in zip('ta', [dates_t, dates_a], 
+                [cases_t, cases_a], labels, cell['legend']):
+            fit = data['fit_' + s][j]
+            if fit[2]:
+                cell['trend_' + s].set_data(*trend_curve(dates[-4:], fit))
+                label += trend_text(fit[0])
+            else:
+                cell['trend_' + s].set_data([], [])
+            cell['data_' + s].set_data(dates, cases)
+            text.set_text(label)
+        cell['name'].set_text(data['comuna'][j])
+    def draw(self, data, page):
+        xlabels = np.arange(data['dates_s'][0], TOMORROW)[::14]
+        maxcases, maxperm = _max_per_mil(data)
+        rows = _page_rows(data, self.nrows, self.ncols, page)
+        for k, cell in enumerate(self.cells):
+            visible = k < len(rows)
+            cell['ax'].set_visible(visible)
+            cell['ax2'].set_visible(visible)
+            if visible:
+                self._update(cell, data, rows[k], maxperm)
+            # the dates below the last two graphs
+            if visible and k >= len(rows) - 2:
+                cell['ax'].set_xticks(xlabels)
+                cell['ax'].set_xticklabels(_date_labels(xlabels), 
+                            rotation=75, ha='right')
+            else:
+                cell['ax'].set_xticks([])
+        # layout of the first page is kept for the following ones
+        if not self._layout:
+            self.fig.tight_layout(pad=2)
+            self.fig.subplots_adjust(hspace=0)
+            self._layout = True
+        return self.fig
+
+_TEMPLATES = {}
+
+def page_template(nrows, ncols):
+    # templates carry the plotting style active when they were built
+    key = (nrows, ncols)
+    if key not in _TEMPLATES:
+        _TEMPLATES[key] = PageTemplate(nrows, ncols)
+    return _TEMPLATES[key]
+
+def plot_region(region, filename=None, trend=False, overwrite=False, date=None,
+        tabs=None, template=False):
     # total and active cases by comuna
-    tabs = retrieve_chilean_region(region, overwrite=overwrite, date=date)
-    ncomunas = len(tabs[0])
-    # plot dimensions 4 x 7 or smaller if fits in one page
-    ncols = 2
-    nrows = min(6, int(np.ceil(ncomunas/ncols)))
-    naxes = nrows * ncols
-    npages = 1 + (ncomunas - 1)//naxes 
-    # do the plotting
-    figs = [plot_page(tabs, nrows, ncols, page, trend=trend) 
-                    for page in range(npages)]
+    if tabs is None:
+        tabs = retrieve_chilean_region(region, overwrite=overwrite, date=date)
+    data = region_arrays(tabs)
+    nrows, ncols, npages = page_grid(len(tabs[0]))
+    # do the plotting, with one figure per page or a single figure
+    # whose content is replaced page after page
+    if template:
+        grid = page_template(nrows, ncols)
+        render = lambda page: grid.draw(data, page)
+    else:
+        render = lambda page: plot_page(data, nrows, ncols, page, trend=trend)
     # save to PDF if given
+    pdf = contextlib.nullcontext()
     if filename:
         filename = os.path.join(GRAPHICSDIR, filename)
         os.makedirs(GRAPHICSDIR, exist_ok=True)
-        with PdfPages(filename) as pdf:
-            for fig in figs:
+        from matplotlib.backends.backend_pdf import PdfPages
+        pdf = PdfPages(filename)
+    figs = []
+    with pdf:
+        for page in range(npages):
+            fig = render(page)
+            if filename:
                 pdf.savefig(fig)
+            if fig not in figs:
+                figs.append(fig)
+        if filename:
             d = pdf.infodict()
             d['Title'] = 'Covid-19 cases in Chilean region {}'.format(region)
             d['Author'] = 'Régis Lachaume'
     return figs 
+
+def write_trend_table(regions, filename, overwrite=False, date=None):
+    retrieve_chilean_data(overwrite=overwrite, date=date)
+    tab = vstack([trend_table(read_chilean_region(r, date=date)) 
+                    for r in regions])
+    os.makedirs(OUTPUTDIR, exist_ok=True)
+    filename = os.path.join(OUTPUTDIR, filename)
+    print('Saving doubling times to', filename)
+    tab.write(filename, format='ascii.csv', overwrite=True)
+    return tab
+
+def _region_filename(region):
+    return 'covid-by-chilean-comuna-region={}.pdf'.format(region)
+
+def _plot_region_job(region, tabs, style, trend):
+    # worker process: render off-screen in the style of the parent
+    from matplotlib import pyplot as plt
+    plt.switch_backend('Agg')
+    filename = _region_filename(region)
+    with PlotStyle(style):
+        plot_region(region, filename, trend=trend, tabs=tabs, template=True)
+    return filename
+
+def plot_regions(regions, style='fivethirtyeight', trend=False, 
+        overwrite=False, date=None, jobs=1):
+    # inputs are parsed once, each region is rendered from its own slice
+    retrieve_chilean_data(overwrite=overwrite, date=date)
+    tabs = [read_chilean_region(r, date=date) for r in regions]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            filenames = pool.map(_plot_region_job, regions, tabs, 
+                            [style] * len(regions), [trend] * len(regions))
+            return list(filenames)
+    filenames = []
+    with PlotStyle(style):
+        _TEMPLATES.clear()
+        for r, t in zip(regions, tabs):
+            print('Region', r)
+            filenames.append(_region_filename(r))
+            plot_region(r, filenames[-1], trend=trend, tabs=t, template=True)
+    return filenames
    
 if __name__ == "__main__":
     try:
@@ -160,6 +389,10 @@ if __name__ == "__main__":
             for fig in figs:
                 fig.show()
         else:
+            # figures are only saved to file
+            import matplotlib
+            matplotlib.use('Agg')
+            from matplotlib import style
             parser = argparse.ArgumentParser(description="COVID-19 cases by Chilean comuna from the bi/triweekly epidemiological reports")
             parser.add_argument('--regions', '-r', type=int, nargs="+", 
                 help='Region numbers', default=np.arange(1, 17))
@@ -174,16 +407,25 @@ if __name__ == "__main__":
                 help='Overwrite files'
             )
             parser.add_argument('--style', '-s', default='fivethirtyeight',
-                choices=plt.style.available + ['xkcd'],
+                choices=style.available + ['xkcd'],
                 help='Plotting style'
             )
+            parser.add_argument('--jobs', '-j', type=int, default=1,
+                help='Number of regions rendered in parallel'
+            )
+            parser.add_argument('--doubling-times', default=False,
+                action="store_true",
+                help='Only save the doubling times by comuna to a CSV file'
+            )
             args = parser.parse_args()
-            with PlotStyle(args.style):
-                for r in args.regions:
-                    print('Region', r)
-                    f = 'covid-by-chilean-comuna-region={}.pdf'.format(r)
-                    figs = plot_region(r, f, trend=args.trend, 
-                        overwrite=args.overwrite, date=args.date)
+            if args.doubling_times:
+                write_trend_table(list(args.regions), 
+                    'doubling-times-by-chilean-comuna.csv',
+                    overwrite=args.overwrite, date=args.date)
+                sys.exit(0)
+            plot_regions(list(args.regions), style=args.style, 
+                trend=args.trend, overwrite=args.overwrite, date=args.date,
+                jobs=args.jobs)
     except Exception as e:
         print('{}: error: {}'.format(sys.argv[0], e))
         raise e
@@ -1,14 +1,16 @@
 #! /usr/bin/env python3
 
 from datahandling import build_international_data_set, get_country_data
+from datahandling import SeriesStore, build_international_cube
 
 import re
+import sys
 import numpy as np
-from matplotlib import pylab as plt
 import argparse 
-from cycler import cycler
+import json
+from concurrent.futures import ProcessPoolExecutor
 from unicodedata import normalize
-import os
+from export import save_figure, output_formats
 
 GRAPHICSDIR = "graphics"
 
@@ -16,7 +18,7 @@ GRAPHICSDIR = "graphics"
 TEXT = {
     'fr': {
         'death': ('deces', 'deces'),
-        'recovered': ('recupere', 'recupes'),
+        'recovery': ('recupere', 'recuperes'),
         'case': ('cas', 'cas'),
         'duplication': ('double tous les 3 jours',
                         'double chaque semaine'),
@@ -27,7 +29,7 @@ TEXT = {
     },
     'es': {
         'death': ('muerto', 'muertos'),
-        'recovered': ('recuperado', 'recuperados'),
+        'recovery': ('recuperado', 'recuperados'),
         'case': ('caso', 'casos'),
         'duplication': ('se duplica cada 3 días',
                         'se duplica cada semana'),
@@ -38,7 +40,7 @@ TEXT = {
     },
     'en': {
         'death': ('death', 'deaths'),
-        'recovered': ('recupery', 'recoveries'),
+        'recovery': ('recovery', 'recoveries'),
         'case': ('case', 'cases'),
         'duplication': ('doubles every 3 days',
                         'doubles every week'),
@@ -65,12 +67,13 @@ def get_text(lang, what, number=None, strip=False):
 
 def country_comparison_plot(tab, countries, variable, 
         date_origin=200, nbin=7, logy=False, trend=False, cum=False,
-        lang='es', style='classic'):
-    strip = arg.style == 'xkcd' # xkcd style can't do unicode
-    if arg.style == 'xkcd':
+        lang='es', style='classic', series=None):
+    from matplotlib import pyplot as plt
+    strip = style == 'xkcd' # xkcd style can't do unicode
+    if style == 'xkcd':
         plt.xkcd()
     else:
-        plt.style.use(arg.style)
+        plt.style.use(style)
     sing = get_text(lang, variable, 'singular', strip=strip)
     plur = get_text(lang, variable, 'plural', strip=strip)
     variablepl = get_text('en', variable, 'plural')
@@ -93,13 +96,16 @@ def country_comparison_plot(tab, countries, variable,
         ax.set_ylabel(newcum.format(plur, nbin))
     if logy:
         print('Using log scale for y')
-        ax.set_yscale('symlog', linthreshy=10)
+        ax.set_yscale('symlog', linthresh=10)
     else:
         ax.set_yscale('linear')
     bgcolor = ax.get_facecolor()
+    if series is None:
+        series = SeriesStore(tab)
     for i, country in enumerate(countries):
         date, value = get_country_data(tab, country, variablepl,    
-                        cum=cum, nbin=nbin, date_origin=date_origin)
+                        cum=cum, nbin=nbin, date_origin=date_origin,
+                        series=series)
         if not len(date):
             print('    {} skipped: no enough {}'.format(country, variablepl)) 
             continue
@@ -124,7 +130,131 @@ def country_comparison_plot(tab, countries, variable,
     fig.tight_layout()
     return fig
 
+# command line options that can be given for each plot of a batch
+PLOT_OPTIONS = ['countries', 'variable', 'origin', 'nbin', 'cum', 'logy', 
+        'trend', 'lang', 'style', 'source', 'output', 'fmt', 'dpi']
+# allowed values of the options that have a choice
+PLOT_CHOICES = {
+    'variable': ['case', 'death', 'recovery'],
+    'lang': ['en', 'es', 'fr'],
+    'source': ['EU', 'JohnHopkins'],
+    'fmt': ['png', 'pdf', 'svg'],
+}
+
+def plot_name(plot):
+    # default file name of a plot in a batch, from all the options changing
+    # the figure so that plots of a batch do not overwrite each other
+    name = 'covid-19-international-{}'.format(
+                get_text('en', plot['variable'], 'plural'))
+    countries = [re.sub(r'\W+', '', c) for c in plot['countries']]
+    name += '-{}-since={}'.format('+'.join(countries), plot['origin'])
+    if plot['cum']:
+        name += '-cumulated'
+    elif plot['nbin'] != 1:
+        name += '-binsize={}'.format(plot['nbin'])
+    if plot['logy']:
+        name += '-log'
+    if plot['trend']:
+        name += '-trend'
+    return name + '-{}-{}'.format(plot['lang'], plot['style'])
+
+def read_batch(filename, defaults={}, choices=PLOT_CHOICES):
+    # plots of a JSON batch file: a list of objects whose keys are command 
+    # line options (as in PLOT_OPTIONS) overriding the default ones, but
+    # for the output file that is named after the plot if not given; two
+    # plots saved to the same file are rejected
+    with open(filename) as f:
+        specs = json.load(f)
+    plots = []
+    for spec in specs:
+        unknown = set(spec) - set(PLOT_OPTIONS)
+        if unknown:
+            raise ValueError('{}: unknown plot option(s): {}'.format(
+                    filename, ', '.join(sorted(unknown))))
+        plot = {k: defaults.get(k) for k in PLOT_OPTIONS if k != 'output'}
+        plot['output'] = None
+        plot.update(spec)
+        if isinstance(plot['fmt'], str):
+            plot['fmt'] = [plot['fmt']]
+        for option, allowed in choices.items():
+            values = plot[option] if option == 'fmt' else [plot[option]]
+            wrong = [v for v in values if v not in allowed]
+            if wrong:
+                raise ValueError('{}: invalid {} {}, choose from {}'.format(
+                    filename, option, ', '.join(map(repr, wrong)), 
+                    ', '.join(map(repr, allowed))))
+        if plot['output'] is None:
+            plot['output'] = plot_name(plot)
+        plots.append(plot)
+    # a file written by two plots would only hold the last one
+    written = {}
+    for k, plot in enumerate(plots):
+        name, formats = output_formats(plot['output'], plot['fmt'])
+        for fmt in formats:
+            other = written.setdefault((name, fmt), k)
+            if other != k:
+                raise ValueError('{}: plots {} and {} are both saved to '
+                    '{}.{}'.format(filename, other + 1, k + 1, name, fmt))
+    return plots
+
+_DATA_SETS = {}
+
+def _init_batch_worker(data_sets):
+    from matplotlib import pyplot as plt
+    plt.switch_backend('Agg')
+    _DATA_SETS.update(data_sets)
+
+def render_plot(plot):
+    # one plot of a batch, from the data sets loaded by run_batch
+    import matplotlib
+    tab, series = _DATA_SETS[plot['source']]
+    with matplotlib.rc_context():
+        fig = country_comparison_plot(tab, plot['countries'], 
+                plot['variable'], date_origin=plot['origin'], 
+                logy=plot['logy'], nbin=plot['nbin'], cum=plot['cum'],
+                trend=plot['trend'], lang=plot['lang'], style=plot['style'],
+                series=series)
+        name, formats = output_formats(plot['output'], plot['fmt'])
+        return save_figure(fig, name, formats, dpi=plot['dpi'],
+                directory=GRAPHICSDIR)
+
+def try_render_plot(plot):
+    # files of a plot, or the error and traceback that stopped it, so that
+    # a failed plot does not stop the rest of the batch
+    try:
+        return render_plot(plot), None
+    except Exception as e:
+        import traceback
+        error = '{}: {}'.format(type(e).__name__, e)
+        return None, (error, traceback.format_exc())
+
+def load_data_set(source, cube=False):
+    # the table and its series, or only the dense cube of JohnHopkins data
+    if cube:
+        if source != 'JohnHopkins':
+            raise ValueError('no cube for data source ' + source)
+        return None, build_international_cube()
+    tab = build_international_data_set(source=source)
+    return tab, SeriesStore(tab)
+
+def run_batch(plots, jobs=1, cube=False):
+    # files and error (None if it succeeded) of each plot; each data set is
+    # loaded and indexed once for all the plots using it
+    data_sets = {}
+    for source in sorted(set(plot['source'] for plot in plots)):
+        data_sets[source] = load_data_set(source, cube=cube)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, 
+                initializer=_init_batch_worker, initargs=(data_sets,)) as pool:
+            return list(pool.map(try_render_plot, plots))
+    _DATA_SETS.update(data_sets)
+    return [try_render_plot(plot) for plot in plots]
+
 if __name__ == "__main__":
+    # figures are only saved to file
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import style
     parser = argparse.ArgumentParser(description=
         'Plot the evolution of daily or total covid-19 statistics for selected'
         ' countries'
@@ -134,7 +264,7 @@ if __name__ == "__main__":
         help='country names or codes'
     )
     parser.add_argument('-s', '--stat', dest='variable',
-        choices=['case', 'death', 'recovery'],
+        choices=PLOT_CHOICES['variable'],
         default='case',
         help='statistic to display'
     )
@@ -156,12 +286,15 @@ if __name__ == "__main__":
         default=None,
         help='filename to save to'
     )
-    group.add_argument('-f', '--format', dest='fmt', 
-        default='pdf',  choices=['png', 'pdf'],
-        help='plot format (pdf or png)',
+    group.add_argument('-f', '--format', dest='fmt', nargs='+',
+        default=['pdf'],  choices=PLOT_CHOICES['fmt'],
+        help='plot format(s) (pdf, png, or svg)',
+    )
+    parser.add_argument('--dpi', type=float, default=None,
+        help='resolution of raster formats'
     )
     parser.add_argument('--lang', default='en', 
-        choices=['en', 'es', 'fr'],
+        choices=PLOT_CHOICES['lang'],
         help='language',
     )
     parser.add_argument('-l', '--log', action='store_true', dest='logy', 
@@ -173,35 +306,70 @@ if __name__ == "__main__":
         help='plot growth trends for doubling every 2 days/week'
     )
     parser.add_argument('--source', 
-        default='JohnHopkins', choices=['EU', 'JohnHopkins'],
+        default='JohnHopkins', choices=PLOT_CHOICES['source'],
         help='data source'
     )
     parser.add_argument('--style',
-        default='fivethirtyeight', choices=plt.style.available + ['xkcd'],
+        default='fivethirtyeight', choices=style.available + ['xkcd'],
         help='plot style'
     )
     parser.add_argument('--debug',
         action='store_true', default=False,
         help='debug mode (internal error message displayed)'
     )
+    parser.add_argument('--batch', default=None,
+        help='JSON file with a list of plots, each an object of options ({})'
+             ' overriding the command line ones but -o'.format(
+                ', '.join(PLOT_OPTIONS))
+    )
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of batch plots rendered in parallel'
+    )
+    parser.add_argument('--cube', action='store_true', default=False,
+        help='read JohnHopkins data into a dense cube instead of a table'
+    )
     arg = parser.parse_args()
+    if arg.batch is not None and arg.output is not None:
+        parser.error('-o cannot be used with --batch: give the output of '
+            'each plot in the batch file')
+    if arg.batch is not None:
+        try:
+            choices = dict(PLOT_CHOICES, style=style.available + ['xkcd'])
+            plots = read_batch(arg.batch, vars(arg), choices=choices)
+            results = run_batch(plots, jobs=arg.jobs, cube=arg.cube)
+        except Exception as e:
+            print('error:', e)
+            if arg.debug:
+                raise e
+            sys.exit(1)
+        failed = [(plot, error) for plot, (files, error) in 
+                    zip(plots, results) if error is not None]
+        for plot, (error, trace) in failed:
+            print('error: plot {}: {}'.format(plot['output'], error))
+            if arg.debug:
+                print(trace)
+        if failed:
+            print('{} of {} plots failed'.format(len(failed), len(plots)))
+            sys.exit(1)
+        sys.exit(0)
     # output file
     if arg.output is None:
-        pdfname = 'covid-19-international-{}s.{}'.format(arg.variable, arg.fmt)
+        pdfname = 'covid-19-international-{}s'.format(arg.variable)
     else:
         pdfname = arg.output 
+    pdfname, formats = output_formats(pdfname, arg.fmt)
     # bin
     try:
-        tab = build_international_data_set(source=arg.source)
+        tab, series = load_data_set(arg.source, cube=arg.cube)
         fig = country_comparison_plot(tab, arg.countries, arg.variable, 
                 date_origin=arg.origin, logy=arg.logy,  
                 nbin=arg.nbin, cum=arg.cum, trend=arg.trend,
-                lang=arg.lang, style=arg.style)
-        os.makedirs(GRAPHICSDIR, exist_ok=True)
-        pdfname = os.path.join(GRAPHICSDIR, pdfname) 
-        fig.savefig(pdfname)
+                lang=arg.lang, style=arg.style, series=series)
+        save_figure(fig, pdfname, formats, dpi=arg.dpi, 
+            directory=GRAPHICSDIR)
     except Exception as e:
         print('error:', e)
         if arg.debug:
             raise e
+        sys.exit(1)
 
@@ -2,23 +2,31 @@
 
 import argparse
 import numpy as np
-import os
-from matplotlib import pylab as plt
 
 from datahandling import build_international_data_set, get_country_data
+from datahandling import SeriesStore, build_international_cube
+from export import save_figure, output_formats
 GRAPHICSDIR = 'graphics'
 
-def plot_country(country, cum=False, logy=False, binsize=None):
-    tab = build_international_data_set(source='JohnHopkins')
-    date, cases = get_country_data(tab, country, 'cases', cum=cum, nbin=binsize)
-    date, deaths = get_country_data(tab, country, 'deaths', cum=cum, nbin=binsize)
-    date, recov = get_country_data(tab, country, 'recoveries', cum=cum, nbin=binsize)
+def plot_country(country, cum=False, logy=False, binsize=None, cube=False):
+    from matplotlib import pyplot as plt
+    if cube:
+        tab, series = None, build_international_cube()
+    else:
+        tab = build_international_data_set(source='JohnHopkins')
+        series = SeriesStore(tab)
+    date, cases = get_country_data(tab, country, 'cases', cum=cum, 
+        nbin=binsize, series=series)
+    date, deaths = get_country_data(tab, country, 'deaths', cum=cum, 
+        nbin=binsize, series=series)
+    date, recov = get_country_data(tab, country, 'recoveries', cum=cum,
+        nbin=binsize, series=series)
     active = cases - deaths - recov
     fig = plt.figure(1)
     fig.clf()
     ax = fig.add_subplot(111)
     if logy:
-        ax.set_yscale('symlog', linthreshy=1)
+        ax.set_yscale('symlog', linthresh=1)
     ax.set_xlabel('days')
     date = np.array(date) - date[0]
     if cum:
@@ -34,6 +42,10 @@ def plot_country(country, cum=False, logy=False, binsize=None):
     return fig
 
 if __name__ == "__main__":
+    # figures are only saved to file
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
     parser = argparse.ArgumentParser(description=
         'Plot the evolution of daily or total covid-19 statistics for selected'
         ' country'
@@ -66,16 +78,23 @@ if __name__ == "__main__":
     group.add_argument('-o', dest='output', default=None,
         help='Output file'
     )
-    group.add_argument('-f', '--format', dest='fmt',
-        default='pdf',  choices=['png', 'pdf'],
-        help='plot format (pdf or png)',
+    group.add_argument('-f', '--format', dest='fmt', nargs='+',
+        default=['pdf'],  choices=['png', 'pdf', 'svg'],
+        help='plot format(s) (pdf, png, or svg)',
+    )
+    parser.add_argument('--dpi', type=float, default=None,
+        help='resolution of raster formats'
+    )
+    parser.add_argument('--cube', action='store_true', default=False,
+        help='read the data into a dense cube instead of a table'
     )
     arg = parser.parse_args()
     # output file
     if arg.output is None:
-        pdfname = 'covid-19-{}.{}'.format(arg.country, arg.fmt)
+        pdfname = 'covid-19-{}'.format(arg.country)
     else:
         pdfname = arg.output
+    pdfname, formats = output_formats(pdfname, arg.fmt)
     # bin
     try:
         if arg.style == 'xkcd':
@@ -83,10 +102,10 @@ if __name__ == "__main__":
         else:
             plt.style.use(arg.style)
         fig = plot_country(arg.country, logy=arg.log, cum=arg.cum,
-            binsize=arg.binsize)
+            binsize=arg.binsize, cube=arg.cube)
         fig.tight_layout()
-        pdfname = os.path.join(GRAPHICSDIR, pdfname)
-        fig.savefig(pdfname)
+        save_figure(fig, pdfname, formats, dpi=arg.dpi, 
+            directory=GRAPHICSDIR)
     except Exception as e:
         print('error:', e)
         if arg.debug:
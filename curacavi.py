@@ -1,20 +1,20 @@
 #! /usr/bin/env python3
 
-from astropy.io import ascii
 import numpy as np
 
-import matplotlib
-from matplotlib import pylab as plt
-from matplotlib.dates import DateFormatter, WeekdayLocator, DayLocator, MO
-from matplotlib.ticker import StrMethodFormatter
-from scipy.stats import linregress
+from datahandling import read_table
+from export import save_figure, FORMATS
 
 
-def grafica_curacavi(plot_log=False, show=True):
+def grafica_curacavi(plot_log=False, show=True, formats=FORMATS, dpi=None):
+    from matplotlib import pyplot as plt
+    from matplotlib.dates import DateFormatter, WeekdayLocator, DayLocator, MO
+    from matplotlib.ticker import StrMethodFormatter
+    from scipy.stats import linregress
 
     HABITANTES = 36430 # proyección 2020
     DAY = np.timedelta64(24, 'h')
-    tabla = ascii.read('input/curacavi.dat')
+    tabla = read_table('input/curacavi.dat')
     fecha = np.array([np.datetime64(d) for d in tabla['fecha']])
     casos = tabla['casos totales']
     activos = tabla['casos activos']
@@ -77,10 +77,10 @@ def grafica_curacavi(plot_log=False, show=True):
         ax3.set_xticks([])
         fuente = 'Municipalidad Informa'
         if i == 1:
-            linthreshy = 1.
-            ax.set_yscale('symlog', linthreshy=linthreshy)
-            linthreshy *= 100 / HABITANTES
-            ax2.set_yscale('symlog', linthreshy=linthreshy)
+            linthresh = 1.
+            ax.set_yscale('symlog', linthresh=linthresh)
+            linthresh *= 100 / HABITANTES
+            ax2.set_yscale('symlog', linthresh=linthresh)
             ax.yaxis.set_major_formatter(StrMethodFormatter('{x:.0f}'))
             ax2.yaxis.set_major_formatter(StrMethodFormatter('{x:g}'))
             ax.text(.02, 0.98, 'escala logarítmica', va='top',
@@ -94,11 +94,12 @@ def grafica_curacavi(plot_log=False, show=True):
     for label in ax.get_xticklabels():
         label.set_rotation(30)
         label.set_ha('right')
-    fig.savefig('graphics/curacavi.png')
-    fig.savefig('graphics/curacavi.pdf')
+    save_figure(fig, 'curacavi', formats, dpi=dpi)
     fig.tight_layout()
     if show:
         fig.show()
 
 if __name__ == "__main__":
+    import matplotlib
+    matplotlib.use('Agg')
     grafica_curacavi(show=False)
@@ -1,14 +1,22 @@
 #! /usr/bin/env python3
 
-import pycountry
 import os
 import time
 import urllib.request
+import urllib.error
+import urllib.parse
+import http.client
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import hashlib
+import codecs
 from astropy.io import ascii as asciitable
-from astropy.table import Table, Column, MaskedColumn
+from astropy.table import Table, Column, MaskedColumn, vstack
 from numpy import datetime64, timedelta64
 import numpy as np
 import re
+import json
 import datetime
 
 
@@ -17,6 +25,118 @@ _US_DATE_RE = '^([0-9]{1,2})/([0-9]{1,2})/([0-9]{2,4})$'
 _EU_DATE_RE = '^([0-9]{1,2})/([0-9]{1,2})/([0-9]{2,4})$'
 INPUTDIR = "input"
 OUTPUTDIR = "output"
+CACHE_VERSION = 2
+
+# layout of the known files, so that they can be read without guessing: 
+# file name pattern, reader options and leading columns with their type
+_CSV = dict(format='csv', delimiter=',', fast_reader=True)
+_COMUNA_COLUMNS = {'Region': str, 'Codigo region': int, 'Comuna': str,
+                   'Codigo comuna': int}
+SCHEMAS = [
+    (r'^covid-19-(confirmed|deaths|recovered)\.csv$', _CSV, 
+        {'Province/State': str, 'Country/Region': str, 'Lat': float, 
+         'Long': float}),
+    (r'^covid-international-.*\.csv$', _CSV,
+        {'date': str, 'cases': int, 'deaths': int, 'country': str, 
+         'region': str, 'population': int}),
+    (r'^Casos(Activos|Acumulados)PorComuna\.csv$', _CSV, _COMUNA_COLUMNS),
+    (r'^([0-9]{4}-[0-9]{2}-[0-9]{2}-)?FechaInicioSintomas\.csv$', _CSV,
+        _COMUNA_COLUMNS),
+    (r'^SemanasEpidemiologicas\.csv$', _CSV, {'Fecha': str}),
+    (r'^death-[0-9]{4}\.csv$', _CSV, 
+        dict(_COMUNA_COLUMNS, Defunciones=int, Fecha=str)),
+    (r'^birth-[0-9]{4}\.csv$', _CSV, 
+        dict(_COMUNA_COLUMNS, Nacimientos=int, Fecha=str)),
+    (r'^population\.csv$', _CSV, {'Region': int, 'Sexo': int, 'Edad': int}),
+    (r'^curacavi\.dat$', dict(format='fixed_width_two_line'), 
+        {'fecha': str, 'casos totales': int}),
+]
+
+def _find_schema(filename):
+    for pattern, options, columns in SCHEMAS:
+        if re.match(pattern, os.path.basename(filename)):
+            return options, columns
+    return None
+
+class TableCache(object):
+    # parsed tables by file path, valid while the file is unchanged, the 
+    # least recently used ones are dropped beyond max_bytes
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    def _stamp(self, filename):
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+    def _entry(self, filename):
+        path = os.path.abspath(filename)
+        stamp = self._stamp(filename)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['stamp'] == stamp:
+                self._entries.move_to_end(path)
+                return entry
+        tab = _read_table(filename)
+        entry = dict(stamp=stamp, table=tab, groups={},
+                    nbytes=sum(c.nbytes for c in tab.columns.values()))
+        with self._lock:
+            if path in self._entries:
+                self.nbytes -= self._entries.pop(path)['nbytes']
+            self._entries[path] = entry
+            self.nbytes += entry['nbytes']
+            while self.nbytes > self.max_bytes and self._entries:
+                path, old = self._entries.popitem(last=False)
+                self.nbytes -= old['nbytes']
+        return entry
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+    def read(self, filename):
+        # a copy, as some callers modify their table in place
+        return self._entry(filename)['table'].copy()
+    def index(self, filename, column):
+        # cached table and its rows by value of column, built once
+        entry = self._entry(filename)
+        tab, groups = entry['table'], entry['groups']
+        if column not in groups:
+            groups[column] = _group_rows(tab[column])
+        return tab, groups[column]
+
+def _group_rows(col):
+    values = np.ma.getdata(col)
+    rows = np.flatnonzero(~np.ma.getmaskarray(col))
+    rows = rows[np.argsort(values[rows], kind='stable')]
+    keys, first = np.unique(values[rows], return_index=True)
+    bounds = np.append(first, len(rows))
+    return {k: rows[start:end] for k, start, end 
+                in zip(keys.tolist(), bounds[:-1], bounds[1:])}
+
+TABLE_CACHE = TableCache()
+
+def read_table(filename, cache=True):
+    if cache:
+        return TABLE_CACHE.read(filename)
+    return _read_table(filename)
+
+def _read_table(filename):
+    # known files are read with their layout, others by format guessing
+    schema = _find_schema(filename)
+    if schema is not None:
+        options, columns = schema
+        try:
+            tab = asciitable.read(filename, guess=False, encoding='utf-8-sig',
+                    **options)
+            for name, dtype in columns.items():
+                if tab[name].dtype.kind != np.dtype(dtype).kind:
+                    with np.errstate(invalid='ignore'): # masked values
+                        tab[name] = tab[name].astype(dtype)
+            return tab
+        except Exception as e:
+            print('Could not read {} with its known layout: {}'.format(
+                    filename, e))
+    return asciitable.read(filename)
 
 def read_time_series(product_number, header_lines=1, columns=None, name=None,
         transposed=True):
@@ -39,7 +159,7 @@ def read_time_series(product_number, header_lines=1, columns=None, name=None,
         
         if header_lines == 1:
             
-            tab = asciitable.read(filename)
+            tab = read_table(filename)
             
         else:    
             
@@ -58,68 +178,338 @@ def read_time_series(product_number, header_lines=1, columns=None, name=None,
         
     else:
         
-        tab = asciitable.read(filename)
+        tab = read_table(filename)
  
     return tab
 
-def retrieve_table(url, local, default_encoding='utf-8-sig', max_time=2 * 3600):
-    # read if recent
+def urlopen(url, headers={}, log=print):
+    # default transport: a response with status, headers and read(); it
+    # does not retry, so has nothing to log
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        return urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        if e.code == 304: # not modified
+            return e
+        raise e
+
+class HTTPTransport(object):
+    # keeps one connection per host and thread, retries with backoff; the
+    # connections stay open until close() or the end of a with block
+    def __init__(self, retries=3, backoff=1, timeout=60, max_redirects=5):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._connections = {}
+        self._lock = threading.Lock()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for conn in connections.values():
+            conn.close()
+    def _connection(self, scheme, host, reset=False):
+        key = (threading.get_ident(), scheme, host)
+        with self._lock:
+            conn = self._connections.get(key)
+            if reset and conn is not None:
+                del self._connections[key]
+        if reset and conn is not None:
+            conn.close()
+            conn = None
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(host, timeout=self.timeout)
+            with self._lock:
+                self._connections[key] = conn
+        return conn
+    def _get(self, url, headers, log):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        for attempt in range(self.retries + 1):
+            try:
+                conn = self._connection(parts.scheme, parts.netloc, 
+                            reset=attempt > 0)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                if response.status < 500:
+                    return response
+                response.read()
+                error = urllib.error.HTTPError(url, response.status,
+                            response.reason, response.headers, None)
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt
+                log('Retry download from', url, 'in', delay, 's:', error)
+                time.sleep(delay)
+        raise error
+    def __call__(self, url, headers={}, log=print):
+        # log(*args) reports the retries as print would
+        for redirect in range(self.max_redirects + 1):
+            response = self._get(url, headers, log)
+            if response.status not in [301, 302, 303, 307, 308]:
+                break
+            response.read()
+            url = urllib.parse.urljoin(url, response.headers['Location'])
+        else:
+            raise urllib.error.HTTPError(url, response.status, 
+                        'more than {} redirects'.format(self.max_redirects),
+                        response.headers, None)
+        if response.status >= 400:
+            response.read()
+            raise urllib.error.HTTPError(url, response.status, 
+                        response.reason, response.headers, None)
+        return response
+
+def _metadata_filename(local):
+    return local + '.meta'
+
+def _read_metadata(local):
+    try:
+        with open(_metadata_filename(local), 'r') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def _write_metadata(local, metadata):
+    with open(_metadata_filename(local), 'w') as fh:
+        json.dump(metadata, fh)
+
+def _file_hash(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _stream_to_file(response, local, encoding, chunk_size=1 << 16):
+    # decode by chunks into a UTF-8 file and hash what is written, the file
+    # is only replaced once complete
+    decoder = codecs.getincrementaldecoder(encoding)()
+    sha = hashlib.sha256()
+    try:
+        with open(local + '.part', 'wb') as fh:
+            while True:
+                chunk = response.read(chunk_size)
+                data = decoder.decode(chunk, final=not chunk).encode('utf-8')
+                sha.update(data)
+                fh.write(data)
+                if not chunk:
+                    break
+    except BaseException as e:
+        if os.path.exists(local + '.part'):
+            os.remove(local + '.part')
+        raise e
+    os.replace(local + '.part', local)
+    return sha.hexdigest()
+
+def _is_recent(local, max_time, metadata=None):
+    # file downloaded or checked less than max_time seconds ago
+    if not os.path.exists(local):
+        return False
+    if metadata is None:
+        metadata = _read_metadata(local)
+    checked = max(os.path.getmtime(local), metadata.get('checked', 0))
+    return time.time() - checked < max_time
+
+def retrieve_table(url, local, default_encoding='utf-8-sig', max_time=2 * 3600,
+        transport=urlopen, log=print):
+    # read if recent, log(*args) reports what is done as print would
     os.makedirs(INPUTDIR, exist_ok=True)
     local = os.path.join(INPUTDIR, local)
-    if (os.path.exists(local) 
-            and time.time() - os.path.getmtime(local) < max_time):
+    metadata = _read_metadata(local)
+    if _is_recent(local, max_time, metadata):
         try:
-            print('Read data from recent file', local)
-            data = asciitable.read(local)
+            log('Read data from recent file', local)
+            data = read_table(local)
             return data
         except:
-            print('Could not read from', local)
+            log('Could not read from', local)
             pass
-    # download
-    print('Download recent data from', url)
-    with urllib.request.urlopen(url) as response:
-        encoding = response.headers.get_content_charset()
-        if encoding is None: # 
-            encoding = default_encoding 
-        contents = response.read().decode(encoding)
-    with open(local, 'w') as fh:
-        fh.write(contents)
-    data = asciitable.read(local)
+    # only download if changed since the local file was downloaded
+    headers = {}
+    if (os.path.exists(local) and metadata.get('url') == url
+            and metadata.get('sha256') == _file_hash(local)):
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+    log('Download recent data from', url)
+    with transport(url, headers=headers, log=log) as response:
+        if response.status == 304:
+            log('Local file is up to date', local)
+        else:
+            encoding = response.headers.get_content_charset()
+            if encoding is None: # 
+                encoding = default_encoding 
+            metadata = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': _stream_to_file(response, local, encoding),
+            }
+    metadata['checked'] = time.time()
+    _write_metadata(local, metadata)
+    data = read_table(local)
     return data
 
-def build_international_data_set(source='EU', max_time = 2 * 3600):
+def retrieve_tables(requests, max_workers=8, transport=None):
+    # requests are keyword arguments of retrieve_table, tables are fetched
+    # concurrently and returned in the same order; the messages of each
+    # request are printed by the calling thread, also in the same order
+    if transport is None:
+        transport = HTTPTransport()
+    logs = [[] for r in requests]
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(retrieve_table, transport=transport, 
+                        log=lambda *args, lines=lines: lines.append(args), **r)
+                        for r, lines in zip(requests, logs)]
+            tabs = []
+            for future, lines in zip(futures, logs):
+                try:
+                    tabs.append(future.result())
+                finally:
+                    for args in lines:
+                        print(*args)
+            return tabs
+    finally:
+        # the connections of the pool threads could not be reused
+        if hasattr(transport, 'close'):
+            transport.close()
+
+def _cache_filename(filename):
+    return os.path.splitext(filename)[0] + '.npz'
+
+def _cache_tags(inputs):
+    # the cache is only valid for the same input files and layout
+    mtimes = [os.path.getmtime(f) if os.path.exists(f) else None 
+                for f in inputs]
+    return {'version': CACHE_VERSION, 'inputs': inputs, 'mtimes': mtimes}
+
+def _write_cache(tab, filename, inputs, wide={}):
+    tags = _cache_tags(inputs)
+    tags['names'] = tab.colnames
+    columns = {}
+    for k, name in enumerate(tab.colnames):
+        col = tab[name]
+        if isinstance(col, MaskedColumn):
+            columns['mask{}'.format(k)] = np.ma.getmaskarray(col)
+            col = col.filled()
+        columns['col{}'.format(k)] = np.asarray(col)
+    wide = {'wide_' + key: value for key, value in wide.items()}
+    np.savez(filename, tags=json.dumps(tags), **columns, **wide)
+
+def _load_cache(filename):
+    # processed table, cache tags and wide tables it was built from
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as data:
+            tags = json.loads(data['tags'].item())
+            names = tags.pop('names')
+            if tags['version'] != CACHE_VERSION:
+                return None
+            columns = []
+            for k, name in enumerate(names):
+                col = data['col{}'.format(k)]
+                mask = 'mask{}'.format(k)
+                if mask in data:
+                    col = MaskedColumn(col, name=name, mask=data[mask])
+                columns.append(col)
+            wide = {key[5:]: data[key] for key in data if key[:5] == 'wide_'}
+    except Exception:
+        print('Could not read from', filename)
+        return None
+    return Table(columns, names=names, copy=False), tags, wide
+
+def _read_cache(filename, inputs):
+    cache = _load_cache(filename)
+    if cache is None:
+        return None
+    tab, tags, wide = cache
+    if tags != _cache_tags(inputs):
+        print('Outdated cache', filename)
+        return None
+    print('Read data from cache', filename)
+    return tab
+
+def _international_sources(source):
+    if source == 'EU':
+        url = 'https://opendata.ecdc.europa.eu/covid19/casedistribution/csv'
+        return [(url, 'covid-19-eu.csv')]
+    elif source == 'JohnHopkins':
+        url = ('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/'
+               'master/csse_covid_19_data/csse_covid_19_time_series/'
+               'time_series_covid19_{}_global.csv')
+        stat = ['confirmed', 'deaths', 'recovered']
+        return [(url.format(s), 'covid-19-{}.csv'.format(s)) for s in stat]
+    raise KeyError('No such data source: ' + source)
+
+def build_international_data_set(source='EU', max_time = 2 * 3600,
+        incremental=True):
+    sources = _international_sources(source)
+    inputs = [os.path.join(INPUTDIR, local) for url, local in sources]
     # read if recent
     os.makedirs(OUTPUTDIR, exist_ok=True)
     filename = 'covid-international-{}.csv'.format(source)
     filename = os.path.join(OUTPUTDIR, filename)
-    if (os.path.exists(filename) 
+    cachename = _cache_filename(filename)
+    if (os.path.exists(cachename)
+            and time.time() - os.path.getmtime(cachename) < max_time):
+        data = _read_cache(cachename, inputs)
+        if data is not None:
+            return data
+    elif (os.path.exists(filename) 
             and time.time() - os.path.getmtime(filename) < max_time):
         try:
             print('Read data from recent file', filename)
-            data = asciitable.read(filename)
+            data = read_table(filename)
             return data
         except:
             print('Could not read from', filename)
             pass
     # process otherwise
+    tables = retrieve_tables([dict(url=url, local=local) 
+                                for url, local in sources])
     if source == 'EU':
-        url = 'https://opendata.ecdc.europa.eu/covid19/casedistribution/csv'
-        csv = 'covid-19-eu.csv'
-        tables = [retrieve_table(url, csv)[::-1]]
-    elif source == 'JohnHopkins':
-        url = ('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/'
-               'master/csse_covid_19_data/csse_covid_19_time_series/'
-               'time_series_covid19_{}_global.csv')
-        stat = ['confirmed', 'deaths', 'recovered']
-        csv = ['covid-19-{}.csv'.format(s) for s in stat]
-        tables = [retrieve_table(url.format(s), c) for s, c in zip(stat, csv)]
-    else:
-        raise KeyError('No such data source: ' + source)
-    print('Processing data and saving to', filename)
+        tables = [t[::-1] for t in tables]
+    # nothing to do if the input files were not downloaded again
+    data = _read_cache(cachename, inputs)
+    if data is not None:
+        os.utime(cachename)
+        return data
     # we want consistent column names
     tables = [_fix_colnames(t) for t in tables]
+    wide = {}
+    if source == 'JohnHopkins':
+        wide = _wide_blocks(tables)
+    # only process the new days if the previous ones were not revised
+    tab = None
+    if incremental:
+        tab = _update_data_set(_load_cache(cachename), tables, wide, source)
+    if tab is None:
+        print('Processing data and saving to', filename)
+        tab = _process_tables(tables, source)
+    tab.write(filename, overwrite=True)
+    _write_cache(tab, cachename, inputs, wide)
+    return tab
+
+def _process_tables(tables, source):
     # we want daily cases not aggregated number
     tables = [_convert_to_daily(t, source) for t in tables]
+    return _process_daily_tables(tables, source)
+
+def _process_daily_tables(tables, source):
     # some tables list cases by region, we also want country total
     tables = [_sum_zones(t, source) for t in tables]
     # merge tables if cases/deaths are separate
@@ -128,9 +518,189 @@ def build_international_data_set(source='EU', max_time = 2 * 3600):
     tab = _fix_date(tab, source)
     # fix country codes
     tab = _fix_country(tab, source)
-    tab.write(filename, overwrite=True)
     return tab
 
+def _date_columns(tab):
+    return [c for c in tab.colnames if re.match(_US_DATE_RE, c)]
+
+def _wide_blocks(tables):
+    # zones and cumulated values of the wide tables, to detect revisions
+    wide = {}
+    for k, tab in enumerate(tables):
+        dates = _date_columns(tab)
+        region = np.ma.filled(tab['region'], '')
+        wide['dates{}'.format(k)] = np.array(dates)
+        wide['zones{}'.format(k)] = np.array([tab['country'], region])
+        wide['block{}'.format(k)] = _date_block(tab, dates)
+    return wide
+
+def _update_data_set(cache, tables, wide, source):
+    if cache is None or source != 'JohnHopkins':
+        return None
+    previous, tags, previous_wide = cache
+    if sorted(wide) != sorted(previous_wide):
+        return None
+    # all tables have the same days, the previous ones being unchanged
+    dates = list(wide['dates0'])
+    ndates = len(previous_wide['dates0'])
+    if ndates < 2:
+        return None
+    for k in range(len(tables)):
+        key = '{}' + str(k)
+        if (list(wide[key.format('dates')]) != dates
+                or list(previous_wide[key.format('dates')]) != dates[:ndates]
+                or not np.array_equal(previous_wide[key.format('zones')],
+                                      wide[key.format('zones')])):
+            return None
+        if not np.array_equal(previous_wide[key.format('block')], 
+                              wide[key.format('block')][:,:ndates]):
+            print('Previous days were revised')
+            return None
+    if len(dates) == ndates:
+        return previous
+    print('Processing {} new days'.format(len(dates) - ndates))
+    # process the new days, keeping the previous two for differencing
+    parts = []
+    for tab in tables:
+        names = [c for c in tab.colnames if c not in dates]
+        part = tab[names + dates[ndates-2:]]
+        part = _convert_to_daily(part, source)
+        part.remove_columns(dates[ndates-2:ndates])
+        parts.append(part)
+    new = _process_daily_tables(parts, source)
+    # append the new days to their zone, keeping the zone order
+    rank = np.empty((len(previous) + len(new),), dtype=int)
+    first = {}
+    for rows in ZoneIndex(previous):
+        row = previous[rows[0]]
+        first[row['country'], row['region']] = rank[rows] = rows[0]
+    for rows in ZoneIndex(new):
+        row = new[rows[0]]
+        key = row['country'], row['region']
+        rank[len(previous) + rows] = first.get(key, len(previous))
+    tab = vstack([previous, new])
+    return tab[np.argsort(rank, kind='stable')]
+
+CUBE_VARIABLES = ('cases', 'deaths', 'recoveries')
+
+class DataCube(object):
+    # zone × date × variable array of daily numbers with its zone and date
+    # indexes, a compact alternative to the long international table whose
+    # zones it keeps in the same order
+    def __init__(self, values, dates, country, region, country_code_2,
+            country_code_3, variables=CUBE_VARIABLES):
+        self.values = values
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.variables = list(variables)
+        self.country = country
+        self.region = region
+        self.country_code_2 = country_code_2
+        self.country_code_3 = country_code_3
+        epoch = datetime.date(1970, 1, 1).toordinal()
+        self.ordinals = self.dates.astype(int) + epoch
+        self._groups = {}
+        for col in ['country', 'country_code_2', 'country_code_3']:
+            for k, (value, r) in enumerate(zip(getattr(self, col), region)):
+                self._groups.setdefault((col, value, r), []).append(k)
+    @property
+    def nbytes(self):
+        arrays = [self.values, self.dates, self.country, self.region,
+                  self.country_code_2, self.country_code_3]
+        return sum(a.nbytes for a in arrays)
+    def zones(self, country, region='all', country_col='country'):
+        return self._groups.get((country_col, country, region), [])
+    def get(self, country, variable, region='all', country_col='country'):
+        # same interface as SeriesStore.get
+        zones = self.zones(country, region, country_col)
+        if not zones:
+            raise RuntimeError('no data for country ' + country)
+        var = self.variables.index(variable)
+        if len(zones) == 1:
+            values = self.values[zones[0],:,var]
+            dates = self.ordinals
+        else:
+            values = self.values[zones,:,var].ravel()
+            dates = np.tile(self.ordinals, len(zones))
+        return dates, values, np.cumsum(values)
+    def table(self):
+        # the long table as built by build_international_data_set
+        nzones, ndates, nvars = self.values.shape
+        dates = np.datetime_as_string(self.dates).astype('U10')
+        columns = [np.tile(dates, nzones)]
+        columns += [self.values[:,:,k].ravel().astype(int) 
+                        for k in range(nvars)]
+        columns += [np.repeat(a, ndates) for a in [self.country, self.region, 
+                    self.country_code_3, self.country_code_2]]
+        columns.append(np.zeros((nzones * ndates,), dtype=int))
+        names = ['date'] + self.variables + ['country', 'region', 
+                    'country_code_3', 'country_code_2', 'population']
+        return Table(columns, names=names)
+
+def _wide_zones(tab):
+    # zones and cumulated numbers of a JohnHopkins table, with country
+    # totals added for the countries only given by region (as _sum_zones)
+    block = _date_block(tab, _date_columns(tab))
+    country = np.array(tab['country'], dtype=str)
+    is_total = np.ma.getmaskarray(tab['region'])
+    region = np.array(np.ma.filled(tab['region'], ''), dtype=str)
+    region = np.where(is_total, 'all', region)
+    totals = np.setdiff1d(country, country[is_total])
+    if len(totals):
+        in_total = np.isin(country, totals)
+        sums = np.zeros((len(totals), block.shape[1]), dtype=block.dtype)
+        np.add.at(sums, np.searchsorted(totals, country[in_total]), 
+                  block[in_total])
+        country = np.append(country, totals)
+        region = np.append(region, np.full(totals.shape, 'all'))
+        block = np.vstack([block, sums])
+    return country, region, block
+
+def _daily(block):
+    # as _convert_to_daily (which leaves the second date cumulated)
+    daily = block.copy()
+    daily[:,2:] = block[:,2:] - block[:,1:-1]
+    return daily
+
+def _cube_from_wide(tables, dtype=np.int32):
+    cases = tables[0]
+    names = _date_columns(cases)
+    dates = _parse_dates(names, 'JohnHopkins')
+    # zones in the order of the long table, deaths and recoveries aligned
+    # on the zones and dates of cases, zero where missing
+    country, region, block = _wide_zones(cases)
+    order = np.lexsort((region, country))
+    country, region = country[order], region[order]
+    blocks = [_daily(block[order])]
+    for tab in tables[1:]:
+        tab_country, tab_region, tab_block = _wide_zones(tab)
+        tab_names = _date_columns(tab)
+        first = {}
+        for k, key in enumerate(zip(tab_country, tab_region)):
+            first.setdefault(key, k)
+        rows = np.array([first.get(key, -1) for key in zip(country, region)],
+                    dtype=int)
+        cols = np.array([tab_names.index(n) if n in tab_names else -1 
+                    for n in names], dtype=int)
+        aligned = np.zeros((len(country), len(names)), dtype=tab_block.dtype)
+        aligned[np.ix_(rows >= 0, cols >= 0)] = _daily(tab_block)[
+                    np.ix_(rows[rows >= 0], cols[cols >= 0])]
+        blocks.append(aligned)
+    # missing days are zero
+    days = np.arange(dates.min(), dates.max() + 1)
+    values = np.zeros((len(country), len(days), len(blocks)), dtype=dtype)
+    for k, block in enumerate(blocks):
+        values[:,(dates - days[0]).astype(int),k] = block
+    names, code2, code3, known = COUNTRY_RESOLVER.resolve(country)
+    return DataCube(values, days, names, region, code2, code3)
+
+def build_international_cube(dtype=np.int32):
+    # the JohnHopkins data set, built from the wide tables without melting
+    sources = _international_sources('JohnHopkins')
+    tables = retrieve_tables([dict(url=url, local=local) 
+                                for url, local in sources])
+    tables = [_fix_colnames(t) for t in tables]
+    return _cube_from_wide(tables, dtype=dtype)
+
 def _symptom_filename(date):
     inicio = 'FechaInicioSintomas.csv'
     if date is not None:
@@ -142,10 +712,10 @@ def retrieve_chilean_data(overwrite=False, date=None):
     inicio = _symptom_filename(date)
     names =  ['CasosActivosPorComuna.csv', 'CasosAcumuladosPorComuna.csv',
         inicio, 'SemanasEpidemiologicas.csv']
-    for name in names:
-        retrieve_table(url + name, name, max_time=7200 * (1-overwrite))
+    retrieve_tables([dict(url=url + name, local=name, 
+                          max_time=7200 * (1-overwrite)) for name in names])
 
-def retrieve_chilean_vitals(year, vital='deaths', date=None, overwrite=False):
+def _chilean_vitals_request(year, vital='deaths', date=None, overwrite=False):
     if vital in ['death', 'deaths', 'defunciones', 'defuncion', 'defunción']:
         name = 'Defunciones'
     else:
@@ -168,51 +738,228 @@ def retrieve_chilean_vitals(year, vital='deaths', date=None, overwrite=False):
         max_time = 3e7
     else:
         max_time = 7200
-    print(localname)
-    tab = retrieve_table(url, localname, max_time=max_time * (1 - overwrite)) 
+    return dict(url=url, local=localname, max_time=max_time * (1 - overwrite))
+
+def retrieve_chilean_vitals(year, vital='deaths', date=None, overwrite=False):
+    request = _chilean_vitals_request(year, vital=vital, date=date,
+                overwrite=overwrite)
+    print(request['local'])
+    tab = retrieve_table(**request) 
     return tab
 
+def retrieve_all_chilean_vitals(years, vital='deaths', date=None, 
+        overwrite=False):
+    # overwrite may be a list of the years to download again
+    if not isinstance(overwrite, bool):
+        overwrite = [year in overwrite for year in years]
+    else:
+        overwrite = [overwrite] * len(years)
+    requests = [_chilean_vitals_request(year, vital=vital, date=date, 
+                    overwrite=o) for year, o in zip(years, overwrite)]
+    tabs = retrieve_tables(requests)
+    return dict(zip(years, tabs))
+
+# vitals are stored by calendar day of a leap year: Feb 29 is the day at
+# index LEAP_DAY and stays empty in the other years
+CALENDAR_DAYS = 366
+LEAP_DAY = 59
+
+def _is_leap(year):
+    return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+def _calendar_days(dates):
+    # calendar day index of datetime64[D] dates
+    years = dates.astype('datetime64[Y]')
+    days = (dates - years).astype(int)
+    leap = _is_leap(years.astype(int) + 1970)
+    return days + ((days >= LEAP_DAY) & ~leap)
+
+class VitalsCube(object):
+    # year × calendar day × comuna counts of births or deaths, the comunas
+    # sorted by region, with the last date of data of each year
+    def __init__(self, counts, years, last, comuna, comuna_name, region,
+            region_name):
+        self.counts = counts
+        self.years = list(years)
+        self.last = np.asarray(last, dtype='datetime64[D]')
+        self.comuna = comuna
+        self.comuna_name = comuna_name
+        self.region = region
+        self.region_name = region_name
+        self.regions, first = np.unique(region, return_index=True)
+        self._region_start = first
+    @property
+    def nbytes(self):
+        arrays = [self.counts, self.last, self.comuna, self.comuna_name,
+                  self.region, self.region_name]
+        return sum(a.nbytes for a in arrays)
+    def zones(self, by='region'):
+        # codes and names of the zones of daily(..., by=by)
+        if by == 'region':
+            first = self._region_start
+            return self.regions, self.region_name[first]
+        return self.comuna, self.comuna_name
+    def _region_column(self, region):
+        # index in regions of a region given by its code or name
+        codes, names = self.zones('region')
+        if isinstance(region, str) and not region.isdigit():
+            k = np.flatnonzero(names == region)
+        else:
+            k = np.flatnonzero(codes == int(region))
+        if not len(k):
+            raise KeyError('No such region: {}'.format(region))
+        return k[0]
+    def daily(self, year, region=None, comuna=None, by=None):
+        # counts for each day of the year (zero after the last date of
+        # data) in the country, a region or a comuna, or day × zone counts
+        # by region or by comuna
+        counts = self.counts[self.years.index(year)]
+        if not _is_leap(year):
+            counts = np.delete(counts, LEAP_DAY, axis=0)
+        if by == 'comuna':
+            return counts
+        if by == 'region':
+            return np.add.reduceat(counts, self._region_start, axis=1)
+        if comuna is not None:
+            return counts[:,np.flatnonzero(self.comuna == comuna)].sum(axis=1)
+        if region is not None:
+            k = self._region_column(region)
+            start = self._region_start[k]
+            end = np.append(self._region_start, len(self.comuna))[k + 1]
+            return counts[:,start:end].sum(axis=1)
+        return counts.sum(axis=1)
+
+def _vitals_cube(tabs, years, dtype=np.int32):
+    # dates are parsed once per table
+    columns = ['Region', 'Codigo region', 'Comuna', 'Codigo comuna']
+    dates = [np.array(tab['Fecha'], dtype='datetime64[D]') for tab in tabs]
+    # comunas sorted by region, their names as in the latest year
+    zones = vstack([tab[columns] for tab in tabs[::-1]])
+    codes, first = np.unique(zones['Codigo comuna'], return_index=True)
+    zones = zones[first]
+    zones = zones[np.lexsort([zones['Codigo comuna'], zones['Codigo region']])]
+    comuna = np.array(zones['Codigo comuna'])
+    counts = np.zeros((len(years), CALENDAR_DAYS, len(comuna)), dtype=dtype)
+    order = np.argsort(comuna)
+    for k, (tab, date) in enumerate(zip(tabs, dates)):
+        zone = order[np.searchsorted(comuna[order], tab['Codigo comuna'])]
+        np.add.at(counts[k], (_calendar_days(date), zone), tab.columns[4])
+    last = [d.max() for d in dates]
+    return VitalsCube(counts, years, last, comuna,
+                np.array(zones['Comuna']), np.array(zones['Codigo region']),
+                np.array(zones['Region']))
+
+def _write_vitals_cache(cube, filename, inputs):
+    tags = _cache_tags(inputs)
+    tags['years'] = cube.years
+    np.savez(filename, tags=json.dumps(tags), counts=cube.counts,
+        last=cube.last, comuna=cube.comuna, comuna_name=cube.comuna_name,
+        region=cube.region, region_name=cube.region_name)
+
+def _read_vitals_cache(filename, inputs):
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as data:
+            tags = json.loads(data['tags'].item())
+            years = tags.pop('years')
+            if tags != _cache_tags(inputs):
+                print('Outdated cache', filename)
+                return None
+            cube = VitalsCube(data['counts'], years, data['last'],
+                        data['comuna'], data['comuna_name'], data['region'],
+                        data['region_name'])
+    except Exception:
+        print('Could not read from', filename)
+        return None
+    print('Read data from cache', filename)
+    return cube
+
+def build_chilean_vitals_cube(years, vital='deaths', date=None,
+        overwrite=False, dtype=np.int32):
+    # overwrite as in retrieve_all_chilean_vitals, the files are only
+    # parsed if they changed since the cube was cached
+    years = list(years)
+    if not isinstance(overwrite, bool):
+        overwrite = [year in overwrite for year in years]
+    else:
+        overwrite = [overwrite] * len(years)
+    requests = [_chilean_vitals_request(year, vital=vital, date=date,
+                    overwrite=o) for year, o in zip(years, overwrite)]
+    inputs = [os.path.join(INPUTDIR, r['local']) for r in requests]
+    stale = [year for year, r, local in zip(years, requests, inputs)
+                if not _is_recent(local, r['max_time'])]
+    if stale:
+        retrieve_all_chilean_vitals(stale, vital=vital, date=date,
+            overwrite=[y for y, o in zip(years, overwrite) if o])
+    os.makedirs(OUTPUTDIR, exist_ok=True)
+    filename = os.path.join(OUTPUTDIR, '{}-{}-{}.npz'.format(vital,
+                    years[0], years[-1]))
+    cube = _read_vitals_cache(filename, inputs)
+    if cube is None or cube.counts.dtype != dtype:
+        cube = _vitals_cube([read_table(f) for f in inputs], years, dtype)
+        _write_vitals_cache(cube, filename, inputs)
+    return cube
+
 def retrieve_chilean_region(region, overwrite=False, date=None):
     retrieve_chilean_data(overwrite=overwrite, date=date)
+    return read_chilean_region(region, date=date)
+
+def read_chilean_region(region, date=None):
     tabs = []
     # parse epidemiological weeks 
     filename = os.path.join(INPUTDIR, 'SemanasEpidemiologicas.csv')
-    weeks = asciitable.read(filename).columns[1:]
+    weeks = read_table(filename).columns[1:]
     weeks = {n: v[0] for n, v in weeks.items()}
     inicio = _symptom_filename(date)
     names = ['CasosAcumuladosPorComuna.csv', 'CasosActivosPorComuna.csv', inicio]
     for name in names:
         filename = os.path.join(INPUTDIR, name)
-        tab = asciitable.read(filename)
-        tab = tab[tab['Codigo region'] == region]
-        tab = tab[tab['Comuna'] != 'Total']
+        tab, regions = TABLE_CACHE.index(filename, 'Codigo region')
+        rows = regions.get(region, np.array([], dtype=int))
+        rows = rows[tab['Comuna'][rows] != 'Total']
+        tab = tab[rows]
         if name == inicio:
             names = [weeks.get(c, c) for c in tab.colnames]
             tab = Table(rows=tab, names=names)
         tabs.append(tab)
     return tabs
 
-def get_country_data(tab, country, variable, region='all', cum=False,
-        nbin=1, date_origin=None):
+def _country_column(country):
     # country names or code?
     country_col = 'country'
     if re.match('^[A-Z]{2,3}[0-9]*$', country):
         country_col = 'country_code_3'
         if len(country) != 3:
             country_col = 'country_code_2'
-    is_country = tab[country_col] == country
-    is_region = tab['region'] == region 
-    index = np.logical_and(is_country, is_region)
-    tab = tab[index]
-    if not len(tab):
-        raise RuntimeError('no data for country ' + country)
-    tab_date = [datetime.date.fromisoformat(d).toordinal() for d in tab['date']]
-    tab_value = np.array(tab[variable].tolist())
-    cum_value = np.cumsum(tab_value)
+    return country_col
+
+def get_country_data(tab, country, variable, region='all', cum=False,
+        nbin=1, date_origin=None, zones=None, series=None):
+    country_col = _country_column(country)
+    if country_col == 'country':
+        country = COUNTRY_RESOLVER.name(country)
+    if series is not None:
+        tab_date, tab_value, cum_value = series.get(country, variable,
+                    region, country_col)
+    else:
+        if zones is not None:
+            index = zones.rows(country, region, country_col)
+        else:
+            is_country = tab[country_col] == country
+            is_region = tab['region'] == region 
+            index = np.logical_and(is_country, is_region)
+        tab = tab[index]
+        if not len(tab):
+            raise RuntimeError('no data for country ' + country)
+        tab_date = [datetime.date.fromisoformat(d).toordinal() 
+                        for d in tab['date']]
+        tab_value = np.array(tab[variable].tolist())
+        cum_value = np.cumsum(tab_value)
     if date_origin is not None:
         if max(cum_value) < date_origin:
             return np.array([]), np.array([])
-        tab_date -= np.interp(date_origin, cum_value, tab_date)
+        tab_date = tab_date - np.interp(date_origin, cum_value, tab_date)
     if cum:
         tab_value = cum_value
     elif nbin > 1:
@@ -221,31 +968,69 @@ def get_country_data(tab, country, variable, region='all', cum=False,
         tab_date = tab_date[nbin-1:]
     return tab_date, tab_value
 
-def _fix_country(tab, source):
-    countries = pycountry.countries
+# country names of the data sets: displayed name, name in pycountry
+COUNTRY_ALIASES = {
+    'US': ('United States', 'United States'), # Bug in Hopkins data description
+    'Korea, South': ('South Korea', 'Korea, Republic of'),
+    'Taiwan*': ('Taiwan', 'Taiwan, Province of China'),
+}
+
+class CountryResolver(object):
+    # displayed name and ISO codes of countries, each distinct name being
+    # looked up once in pycountry after translation by the alias table
+    def __init__(self, aliases=COUNTRY_ALIASES):
+        self.aliases = dict(aliases)
+        self._cache = {}
+    def __call__(self, country):
+        # displayed name, alpha-2 and alpha-3 codes (None if unknown)
+        if country not in self._cache:
+            name, lookup = self.aliases.get(country, (country, country))
+            import pycountry
+            c = pycountry.countries.get(name=lookup)
+            codes = (c.alpha_2, c.alpha_3) if c else (None, None)
+            self._cache[country] = (name,) + codes
+        return self._cache[country]
+    def name(self, country):
+        # the displayed name only depends on the alias table, pycountry is
+        # not needed
+        if country in self._cache:
+            return self._cache[country][0]
+        return self.aliases.get(country, (country, country))[0]
+    def resolve(self, countries):
+        # names, alpha-2 and alpha-3 codes ('  ' and '   ' if unknown) of an 
+        # array of countries, and whether they are known
+        unique, index = np.unique(np.asarray(countries, dtype=str), 
+                            return_inverse=True)
+        resolved = [self(c) for c in unique]
+        names = np.array([r[0] for r in resolved], dtype=str)[index]
+        code2 = np.array([r[1] or '  ' for r in resolved], dtype=str)[index]
+        code3 = np.array([r[2] or '   ' for r in resolved], dtype=str)[index]
+        known = np.array([r[1] is not None for r in resolved], dtype=bool)
+        return names, code2, code3, known[index]
+
+COUNTRY_RESOLVER = CountryResolver()
+
+def _fix_country(tab, source, resolver=None):
     if source == 'JohnHopkins':
-        for row in tab:
-            country = row['country']
-            if country == 'US': # Bug in Hopkins data description
-                row['country'] = 'United States'
-                country = row['country']
-            elif country == 'Korea, South':
-                row['country'] = 'South Korea'
-                country = 'Korea, Republic of'
-            elif country == 'Taiwan*':
-                row['country'] = 'Taiwan'
-                country = 'Taiwan, Province of China'
-            c = countries.get(name=country)
-            if c:
-                row['country_code_2'] = c.alpha_2
-                row['country_code_3'] = c.alpha_3
+        if resolver is None:
+            resolver = COUNTRY_RESOLVER
+        names, code2, code3, known = resolver.resolve(tab['country'])
+        tab.replace_column('country', Column(names))
+        for name, codes in [('country_code_2', code2), 
+                            ('country_code_3', code3)]:
+            tab.replace_column(name, 
+                        Column(np.where(known, codes, tab[name])))
     return tab
 
 def _convert_to_daily(tab, source):
     if source == 'JohnHopkins':
-        cols = [c for c in tab.colnames if re.match(_US_DATE_RE, c)]
-        for c2, c1 in zip(cols[-1:1:-1], cols[-2:0:-1]):
-            tab[c2] -= tab[c1]
+        # as always, the second date is left cumulated
+        cols = _date_columns(tab)
+        if len(cols) > 2:
+            block = np.column_stack([tab[c] for c in cols[1:]])
+            daily = np.diff(block, axis=1)
+            for j, c in enumerate(cols[2:]):
+                tab[c][:] = daily[:,j]
     return tab
 
 def _fix_colnames(tab):
@@ -253,7 +1038,7 @@ def _fix_colnames(tab):
     for name in ['day', 'month', 'year', 'Long', 'Lat']:
         if name in tab.colnames:
             tab.remove_column(name)
-    for col in tab.columns.values():
+    for col in list(tab.columns.values()):
         if col.name in ['countriesAndTerritories', 'Country/Region']:
             col.name = 'country'
         if col.name in 'Province/State':
@@ -268,41 +1053,160 @@ def _fix_colnames(tab):
             col.name = 'date'
     return tab 
 
-def _select_zone(tab, country, region):
+class ZoneIndex(object):
+    # row groups by (country, region), built with a single stable sort
+    def __init__(self, tab):
+        order = np.lexsort((tab['region'], tab['country']))
+        country, region = tab['country'][order], tab['region'][order]
+        first = np.ones((len(order),), dtype=bool)
+        first[1:] = (country[1:] != country[:-1]) | (region[1:] != region[:-1])
+        self.order = order
+        self.offsets = np.append(np.flatnonzero(first), len(order))
+        # zones can also be looked up by country code
+        cols = [c for c in ['country', 'country_code_2', 'country_code_3']
+                    if c in tab.colnames]
+        self._groups = {}
+        for k, start in enumerate(self.offsets[:-1]):
+            row = order[start]
+            for col in cols:
+                key = (col, tab[col][row], tab['region'][row])
+                if any(v is np.ma.masked for v in key):
+                    continue
+                self._groups.setdefault(key, []).append(k)
+    def __len__(self):
+        return len(self.offsets) - 1
+    def __iter__(self):
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.order[start:end]
+    def rows(self, country, region, country_col='country'):
+        groups = self._groups.get((country_col, country, region), [])
+        rows = [self.order[self.offsets[k]:self.offsets[k+1]] for k in groups]
+        if len(rows) == 1:
+            return rows[0]
+        return np.sort(np.hstack([[]] + rows).astype(int))
+
+class SeriesStore(object):
+    # date ordinals, values, and cumulated values of every zone stored
+    # contiguously, looked up by country name or code and region without
+    # copying
+    def __init__(self, tab, variables=('cases', 'deaths', 'recoveries'),
+            zones=None):
+        if zones is None:
+            zones = ZoneIndex(tab)
+        self.zones = zones
+        order, offsets = zones.order, zones.offsets
+        epoch = datetime.date(1970, 1, 1).toordinal()
+        dates = np.array(tab['date'][order], dtype='datetime64[D]')
+        self.dates = dates.astype(int) + epoch
+        self.values, self.cumulated = {}, {}
+        lengths = np.diff(offsets)
+        for var in variables:
+            values = np.ma.filled(tab[var][order], 0)
+            cumulated = np.cumsum(values)
+            # restart the sum at the beginning of each zone
+            before = np.append(0, cumulated[offsets[1:-1] - 1])
+            self.values[var] = values
+            self.cumulated[var] = cumulated - np.repeat(before, lengths)
+        self._merged = {}
+    def _zone(self, key):
+        groups = self.zones._groups.get(key, [])
+        if len(groups) == 1:
+            start, end = self.zones.offsets[groups[0]:groups[0]+2]
+            return slice(start, end)
+        # several zones (with the same country code): rows in table order
+        if key not in self._merged:
+            rows = np.hstack([[]] + [np.arange(*self.zones.offsets[k:k+2]) 
+                    for k in groups]).astype(int)
+            self._merged[key] = rows[np.argsort(self.zones.order[rows])]
+        return self._merged[key]
+    def get(self, country, variable, region='all', country_col='country'):
+        zone = self._zone((country_col, country, region))
+        dates = self.dates[zone]
+        if not len(dates):
+            raise RuntimeError('no data for country ' + country)
+        values = self.values[variable][zone]
+        if isinstance(zone, slice):
+            cumulated = self.cumulated[variable][zone]
+        else:
+            cumulated = np.cumsum(values)
+        return dates, values, cumulated
+
+def _select_zone(tab, country, region, zones=None):
+    if zones is not None:
+        return tab[zones.rows(country, region)]
     same_country = tab['country'] == country
     same_region = tab['region'] == region
     index = np.logical_and(same_country, same_region)
     return tab[index]
 
-def _iterzone(tab):
-    for country in np.unique(tab['country']):
-        for region in np.unique(tab['region']):
-            yield _select_zone(tab, country, region)
+def _iterzone(tab, zones=None):
+    if zones is None:
+        zones = ZoneIndex(tab)
+    for rows in zones:
+        yield tab[rows]
+
+def _parse_date(date, source):
+    if source == 'EU':
+        d, m, y = re.match(_EU_DATE_RE, date).groups()
+    else:
+        m, d, y = re.match(_US_DATE_RE, date).groups()
+    y, m, d = [int(x) for x in [y, m, d]]
+    if y < 50:
+        y += 2000
+    elif y < 100:
+        y += 1950
+    return datetime.date(y, m, d)
+
+def _parse_dates(dates, source):
+    # each distinct date string is only parsed once
+    unique, index = np.unique(dates, return_inverse=True)
+    unique = [_parse_date(d, source).isoformat() for d in unique]
+    return np.array(unique, dtype='datetime64[D]')[index]
+
+def _fix_date(tab, source, columnar=True):
+    if not columnar:
+        return _fix_date_by_row(tab, source)
+    names = tab.colnames
+    # zones are contiguous after sorting, rows keep their order in zone
+    zones = ZoneIndex(tab)
+    tab = tab[zones.order]
+    dates = _parse_dates(tab['date'], source)
+    first = np.zeros((len(tab),), dtype=bool)
+    first[zones.offsets[:-1]] = True
+    # number of output rows ending at each input row: the row itself plus
+    # the missing days before it in the same zone
+    nrows = np.ones((len(tab),), dtype=int)
+    nrows[1:] = np.maximum(1, (dates[1:] - dates[:-1]).astype(int))
+    nrows[first] = 1
+    last = np.cumsum(nrows) - 1
+    source_row = np.repeat(np.arange(len(tab)), nrows)
+    shift = last[source_row] - np.arange(len(source_row))
+    is_missing = shift > 0
+    columns = [np.datetime_as_string(dates[source_row] - shift).astype('U10')]
+    for name in names[1:]:
+        col = tab[name][source_row]
+        if name in ['cases', 'deaths', 'recoveries']:
+            col[is_missing] = 0
+        columns.append(col)
+    tab = Table(columns, names=names)
+    return tab
 
-def _fix_date(tab, source):
+def _fix_date_by_row(tab, source):
     rows = []
     names = tab.colnames
     for zone in _iterzone(tab):
         previous_date = None
         for row in zone:
             row = row.as_void().tolist()
-            if source == 'EU':
-                d, m, y = re.match(_EU_DATE_RE, row[0]).groups()
-            else:
-                m, d, y = re.match(_US_DATE_RE, row[0]).groups()
-            y, m, d = [int(x) for x in [y, m, d]]
-            if y < 50:
-                y += 2000
-            elif y < 100:
-                y += 1950
-            date = datetime.date(y, m, d)
+            date = _parse_date(row[0], source)
             if previous_date is not None:
                 while True:
                     previous_date += datetime.timedelta(days=1)
                     if previous_date >= date:
                         break
-                    newrow = (previous_date.isoformat(), 0, 0, 0, *row[3:])
+                    newrow = (previous_date.isoformat(), 0, 0, 0, *row[4:])
                     rows.append(newrow)
+            previous_date = date
             newrow = (date.isoformat(), *(row[1:]))
             rows.append(newrow)
     tab = Table(rows=rows, names=names)
@@ -315,54 +1219,68 @@ def _sum_zones(tab, source):
         region = np.full_like(tab['country'].data, 'all')
         tab.add_column(Column(region, 'region'))
         return tab
+    # rows without region are the global stat of their country
+    country = np.asarray(tab['country'])
+    is_global = np.ma.getmaskarray(tab['region']).copy()
+    tab['region'][is_global] = 'all'
     # if there is no global stat for country, sum all of its regions
-    for country in np.unique(tab['country']):
-        same_country = tab['country'] == country
-        is_region = tab['region'].mask == False
-        is_global = np.logical_and(np.logical_not(is_region), same_country)
-        if any(is_global):
-            tab['region'][is_global] = 'all'
-            continue
-        is_region = np.logical_and(is_region, same_country)
-        if not any(is_region):
-            continue
-        regions = tab[is_region] 
-        row = ['all', country]
-        if source == 'JohnHopkins':
-            datacols = [n for n in tab.colnames if re.match(_US_DATE_RE, n)]
-            row += [np.sum(regions[col]) for col in datacols]
-        tab.add_row(row)    
-    return tab
+    totals = np.setdiff1d(country, country[is_global])
+    if not len(totals):
+        return tab
+    rows = np.flatnonzero(np.isin(country, totals))
+    rows = rows[np.argsort(country[rows], kind='stable')]
+    starts = np.flatnonzero(np.append(True, 
+                country[rows][1:] != country[rows][:-1]))
+    columns = [np.full(totals.shape, 'all'), totals]
+    if source == 'JohnHopkins':
+        datacols = _date_columns(tab)
+        block = np.column_stack([tab[c] for c in datacols])
+        sums = np.add.reduceat(block[rows], starts, axis=0)
+        columns += list(sums.T)
+    else:
+        datacols = []
+    names = ['region', 'country'] + datacols
+    return vstack([tab, Table(columns, names=names)])
         
+def _date_block(tab, dates):
+    # zone x date array
+    block = np.zeros((len(tab), len(dates)), dtype=int)
+    for j, date in enumerate(dates):
+        block[:,j] = tab[date]
+    return block
+
+def _join_date_block(tab, country, region, dates):
+    # zone x date array aligned on the given zones, zero where missing
+    zones = ZoneIndex(tab)
+    rows = [zones.rows(c, r) for c, r in zip(country, region)]
+    found = np.array([len(r) > 0 for r in rows], dtype=bool)
+    rows = np.array([r[0] for r in rows if len(r)], dtype=int)
+    block = np.zeros((len(country), len(dates)), dtype=int)
+    present = [j for j, d in enumerate(dates) if d in tab.colnames]
+    present_dates = [dates[j] for j in present]
+    block[np.ix_(found, present)] = _date_block(tab[rows], present_dates)
+    return block
+
 def _merge_tables(tables, source):
     colnames = ('date', 'cases', 'deaths',
                 'recoveries', 'country', 'region', 
                 'country_code_3', 'country_code_2', 'population')
     if source == 'JohnHopkins':
-        rows = []
+        # John Hopkins give one column per date, melt them into rows 
         cases, deaths, recov = tables
-        for row_c in cases:
-            # John Hopkins give total numbers, go back to daily new cases/deaths
-            region, country = row_c['region'], row_c['country']
-            row_d = _select_zone(deaths, country, region)
-            row_r = _select_zone(recov, country, region)
-            for usdate in cases.colnames:
-                if not re.match(_US_DATE_RE, usdate):
-                    continue
-                num_cases = row_c[usdate]
-                num_recov = 0
-                num_deaths = 0
-                if len(row_d) and usdate in row_d.columns:
-                    num_deaths = row_d[usdate].item()
-                if len(row_r) and usdate in row_r.columns:
-                    try:
-                        num_recov = row_r[usdate].item()
-                    except Exception as e:
-                        raise e
-                row = (usdate, num_cases, num_deaths, num_recov, 
-                        country, region, '   ', '  ', 0)
-                rows.append(row)
-        tab = Table(rows=rows, names=colnames)
+        dates = [c for c in cases.colnames if re.match(_US_DATE_RE, c)]
+        country, region = cases['country'], cases['region']
+        num_cases = _date_block(cases, dates)
+        num_deaths = _join_date_block(deaths, country, region, dates)
+        num_recov = _join_date_block(recov, country, region, dates)
+        nzones, ndates = num_cases.shape
+        nrows = nzones * ndates
+        columns = [np.tile(dates, nzones), num_cases.ravel(), 
+                   num_deaths.ravel(), num_recov.ravel(),
+                   np.repeat(country, ndates), np.repeat(region, ndates),
+                   np.full((nrows,), '   '), np.full((nrows,), '  '),
+                   np.zeros((nrows,), dtype=int)]
+        tab = Table(columns, names=colnames)
     elif source == 'EU':
         tab = tables[0]
         recov = np.ma.masked_array([0] * len(tab), mask=True)
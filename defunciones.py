@@ -1,16 +1,15 @@
 #! /usr/bin/env python3
 
+import argparse
 import locale
-locale.setlocale(locale.LC_ALL, '')
-
-from astropy.table import Table
-from numpy import datetime64
 import os
+from numpy import datetime64
 import numpy as np
-from matplotlib import pylab as plt
-from scipy.stats import linregress
+from astropy.table import Table
 
-from datahandling import retrieve_chilean_vitals 
+from datahandling import (retrieve_chilean_vitals, build_chilean_vitals_cube,
+    read_table, INPUTDIR, OUTPUTDIR)
+from export import save_figure, FORMATS
 
 POPULATION = {
     2010: 17.063927,
@@ -28,16 +27,23 @@ POPULATION = {
 
 HALFDAY = np.timedelta64(12, 'h')
 DAY = np.timedelta64(24, 'h')
-THISYEAR = int(str(np.datetime64('now'))[0:4])
+EXCESS_START = '2020-04-01'
 
-def bin_data(dates, values, binsize='month'):
-    year = dates[0].item().year
+def populations(years, region=None):
+    # population (millions) of Chile, or of the regions given by their
+    # code (a number or an array of them)
+    if region is None:
+        return {year: POPULATION[year] for year in years}
+    tab = read_table(os.path.join(INPUTDIR, 'population.csv'))
+    region = np.asarray(region, dtype=int)
+    return {year: np.bincount(tab['Region'], 
+                    weights=tab['a{}'.format(year)])[region] / 1e6
+                for year in years}
+
+def bin_edges(year, lastday, binsize='month'):
+    # bin limits (half a day before the first day of each bin), widths
+    # in days and centres of the bins of a year up to lastday (MM-DD)
     firstday = '01-01'
-    if year < THISYEAR:
-        lastday = '12-31'
-    else:
-        lastday = str(np.unique(dates)[-1])[5:10]
-    lastmonth = int(lastday[3:])
     first = np.datetime64('{}-{}'.format(year, firstday)) - HALFDAY
     last = np.datetime64('{}-{}'.format(year, lastday)) + HALFDAY
     if isinstance(binsize, int):
@@ -60,11 +66,30 @@ def bin_data(dates, values, binsize='month'):
         width = width[1:]
         bins = np.delete(bins, 1)
     centres = bins[:-1] + width * DAY / 2
+    return bins, width, centres
+
+def bin_data(dates, values, binsize='month', last=None):
+    # the year is binned up to its last date of data (by default the last
+    # of dates), whether or not it is over
+    year = dates[0].item().year
+    if last is None:
+        last = np.max(dates)
+    lastday = str(last)[5:10]
+    bins, width, centres = bin_edges(year, lastday, binsize=binsize)
     binned_values, unused = np.histogram(dates, bins=bins, weights=values) 
     binned_values = binned_values / width
-    print(width)
     return centres, width, binned_values
-     
+
+def bin_days(year, values, last, binsize='month'):
+    # as bin_data for the counts of each day of the year since January 1st
+    # (day × zone for several zones at once)
+    lastday = str(last)[5:10]
+    bins, width, centres = bin_edges(year, lastday, binsize=binsize)
+    start = ((bins - bins[0]) // DAY).astype(int)
+    binned_values = np.add.reduceat(values[:start[-1]], start[:-1], axis=0)
+    binned_values = binned_values / width.reshape((-1,) + (1,) * 
+                        (np.ndim(values) - 1))
+    return centres, width, binned_values
 
 def weeknumber(date=None, binsize=7):
     if date is None:
@@ -74,9 +99,18 @@ def weeknumber(date=None, binsize=7):
     day = [(datetime64(d) - start).item().days for d in date]
     return 1 + np.array(day) // binsize
 
-def get_vital(year, vital='death', region=None, binsize='month'):
+def get_vital(year, vital='death', region=None, binsize='month', tab=None,
+        cube=None):
+    # from the year × day × comuna cube if given
     CODIGO_REGION = [str(i) for i in range(1, 17)]
-    tab = retrieve_chilean_vitals(year, vital=vital, overwrite=year == 2020)
+    if cube is not None:
+        values = cube.daily(year, region=region)
+        last = cube.last[cube.years.index(year)]
+        return bin_days(year, values, last, binsize=binsize)
+    if tab is None:
+        tab = retrieve_chilean_vitals(year, vital=vital, overwrite=year == 2020)
+    # the data of all regions tell when the year ends
+    last = np.max(np.array(tab['Fecha'], dtype='datetime64[D]'))
     if region is not None:
         colname = 'Region'
         if isinstance(region, int) or region in CODIGO_REGION:
@@ -85,28 +119,62 @@ def get_vital(year, vital='death', region=None, binsize='month'):
     dates = np.array([np.datetime64(d) for d in tab['Fecha']])
     values = tab.columns[4].data
     centres, width, binned_values = bin_data(dates, values, 
-        binsize=binsize)
+        binsize=binsize, last=last)
     return centres, width, binned_values
 
-def mortality_rate_correction(past_years, past_widths, past_values):
-    past_mortalities = np.array([sum(w*v)/sum(w) / POPULATION[y] 
+def mortality_rate_correction(past_years, past_widths, past_values,
+        population=POPULATION):
+    # least squares line through the mean mortality of the past years,
+    # for each zone if the values have a trailing zone axis
+    past_years = np.asarray(past_years)
+    past_mortalities = np.array([np.tensordot(w, v, axes=(0, 0)) / sum(w) 
+            / population[y]
         for w, v, y in zip(past_widths, past_values, past_years)])
-    a, b, *unused = linregress(past_years, past_mortalities)
+    x = past_years.reshape((-1,) + (1,) * (past_mortalities.ndim - 1))
+    dx = x - x.mean(axis=0)
+    dy = past_mortalities - past_mortalities.mean(axis=0)
+    a = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+    b = past_mortalities.mean(axis=0) - a * x.mean(axis=0)
     mortality_now = a * (past_years[-1] + 1) + b
-    correction = mortality_now / (a * past_years + b) 
+    correction = mortality_now / (a * x + b) 
     return correction
 
+def baseline(past_mortality):
+    # mean and range of the past years, the lowest and highest left out
+    m = np.sort(past_mortality, axis=0)[1:-1]
+    return m.mean(axis=0), m.min(axis=0), m.max(axis=0)
+
+def excess_deaths(present, past_mortality, population, start=EXCESS_START):
+    # deaths, expected deaths and excess deaths between the bin of start
+    # and the last one, with the errors from the range of the past years
+    # (for each zone if arrays have a trailing zone axis)
+    dates, binwidths, mortality = present
+    mean, mini, maxi = baseline(past_mortality)
+    keep = np.argwhere(dates >= np.datetime64(start))[:,0]
+    fact = binwidths[keep].reshape((-1,) + (1,) * (np.ndim(mortality) - 1))
+    fact = fact * population
+    begin = dates[keep][0] - binwidths[keep][0] * DAY / 2
+    end = dates[-1] + binwidths[-1] * DAY / 2
+    deaths = np.sum(mortality[keep] * fact, axis=0)
+    expected = np.sum(mean[keep] * fact, axis=0)
+    excess = np.sum((mortality[keep] - mean[keep]) * fact, axis=0)
+    errinf = np.sum((maxi[keep] - mean[keep]) * fact, axis=0)
+    errsup = np.sum((mean[keep] - mini[keep]) * fact, axis=0)
+    return begin, end, deaths, expected, excess, errinf, errsup
+
 def transpose_date(dates):
     dates = ['2020-' + (str(d)[5:10]) for d in dates]
     dates = np.array([np.datetime64(d) for d in dates])
     return dates
 
 def plot_vital(past, present,
-        vital='death', plotall=False, plotexcess=False, fignum=1):
+        vital='death', plotall=False, plotexcess=False, fignum=1,
+        region=None, formats=FORMATS, dpi=None, show=False):
     from matplotlib import pylab as plt
     from matplotlib.dates import DateFormatter, MonthLocator
     dates, binwidths, mortality = present
     past_dates, past_binwidths, past_mortality = past
+    population = populations([2020], region=region)[2020]
     fig = plt.figure(fignum)
     fig.clf()
     ax = fig.add_subplot(111)
@@ -116,11 +184,7 @@ def plot_vital(past, present,
             year = d[0].item().year
             plotdates = transpose_date(d)
             ax.plot(plotdates, m * 365/1000, 'k-', label=str(year), lw=1)
-    m = np.sort(past_mortality, axis=0)[1:-1]
-    mean = m.mean(axis=0)
-    std = m.std(axis=0,ddof=1) 
-    maxi = m.max(axis=0)
-    mini = m.min(axis=0) 
+    mean, mini, maxi = baseline(past_mortality)
     plotdates = transpose_date(past_dates[0])
     end = dates[-1] + binwidths[-1] * DAY / 2
     now = end.item().strftime('%d\\ %b')
@@ -143,19 +207,16 @@ def plot_vital(past, present,
     ax.set_xlim(np.datetime64('2020-01-01'), np.datetime64('2021-01-01'))
     ax.set_ylabel('tasa de mortalidad anualizada [‰]')
     ax2 = ax.twinx()
-    ax2.set_ylim(0, ymax * 1000 / 365 * POPULATION[2020])
+    ax2.set_ylim(0, ymax * 1000 / 365 * population)
     ax2.set_ylabel('muertes diarias (2020)'.format(vital))
     ax3 = ax.twiny()
     ax3.set_xticks([])
-    ax3.set_xlabel('Fallecimientos en Chile. Datos históricos corregidos de la tendencia secular.'.format(vital))
+    where = 'Chile' if region is None else 'la región {}'.format(region)
+    ax3.set_xlabel('Fallecimientos en {}. Datos históricos corregidos de la tendencia secular.'.format(where))
     if plotexcess:
-        keep = np.argwhere(dates >= np.datetime64('2020-04-01'))[:,0]
-        fact = binwidths[keep] * POPULATION[2020]
-        begin = dates[keep][0] - binwidths[keep][0] * DAY / 2
+        begin, end, deaths, expected, excess, errinf, errsup = \
+            excess_deaths(present, past_mortality, population)
         begin = begin.item().strftime('%d\\ %b') 
-        excess = np.sum((mortality[keep] - mean[keep]) * fact)
-        errinf = np.sum((maxi[keep] - mean[keep]) * fact)
-        errsup = np.sum((mean[keep] - mini[keep]) * fact)
         what = f'exceso\\ de\\ fallecimientos\\ ({begin}-{now})'
         FMT = '$\\mathrm{{{}}}: {:.0f}^{{{:+.0f}}}_{{{:+.0f}}}$'
         txt = FMT.format(what, excess, errsup, -errinf)
@@ -163,35 +224,167 @@ def plot_vital(past, present,
             transform=ax.transAxes)
     fig.autofmt_xdate()
     fig.tight_layout()
-    fig.show()
-    fig.savefig('graphics/{}-statistics.png'.format(vital))
-    fig.savefig('graphics/{}-statistics.pdf'.format(vital))
+    if show:
+        fig.show()
+    name = '{}-statistics'.format(vital)
+    if region is not None:
+        name += '-region-{}'.format(region)
+    save_figure(fig, name, formats, dpi=dpi)
+    return fig
 
-def load_vital(vital='death', region=None, correction=False, binsize='month'):
+def load_vital(vital='death', region=None, correction=False, binsize='month',
+        update=True, cube=None):
     past_years = np.arange(2010, 2020)
-    past = [get_vital(year, vital=vital, binsize=binsize) 
-        for year in range(2010, 2020)]
+    if cube is None:
+        cube = build_chilean_vitals_cube(range(2010, 2021), vital=vital,
+            overwrite=[2020] if update else False)
+    population = populations(range(2010, 2021), region=region)
+    past = [get_vital(year, vital=vital, region=region, binsize=binsize, 
+                cube=cube) for year in range(2010, 2020)]
     past = list(zip(*past))
     past_dates, past_binwidths, past_values = past 
-    past_mortality = np.array([v / POPULATION[y] 
+    past_mortality = np.array([v / population[y] 
                             for y, v in zip(past_years, past_values)])
-    present = get_vital(2020, vital=vital, binsize=binsize)
+    present = get_vital(2020, vital=vital, region=region, binsize=binsize, 
+                cube=cube)
     dates, binwidths, values = present
-    mortality = values / POPULATION[2020]
+    mortality = values / population[2020]
     if correction:
         corr = mortality_rate_correction(past_years, past_binwidths, 
-            past_values)
+            past_values, population=population)
         past_mortality *= corr[:,None]
     past = (past_dates, past_binwidths, past_mortality)
     present = (dates, binwidths, mortality)
     return past, present
     
 
-def compare_this_year(vital='death', plot='', correction=True, binsize=14):
-    past, present = load_vital(vital=vital, correction=correction, 
-            binsize=binsize)
-    plot_vital(past, present, plotexcess=True, vital=vital, plotall=plot == 'all')
+def load_zone_vitals(cube, binsize='month', correction=True):
+    # zones (country, regions and comunas), their population and their
+    # past and present mortality (bin × zone); comunas are given the
+    # population of their region as only the deaths they yield matter
+    past_years = np.arange(2010, 2020)
+    regions, region_names = cube.zones('region')
+    codes = np.hstack([[0], regions, cube.comuna])
+    zones = Table([np.repeat(['country', 'region', 'comuna'], 
+                        [1, len(regions), len(codes) - len(regions) - 1]),
+                   codes, np.hstack([['Chile'], region_names, cube.comuna_name]),
+                   np.hstack([[0], regions, cube.region])], 
+                  names=['level', 'code', 'name', 'region'])
+    population = populations(range(2010, 2021), region=regions)
+    comuna_region = np.searchsorted(regions, cube.region)
+    population = {year: np.hstack([[POPULATION[year]], pop, 
+                            pop[comuna_region]])
+                    for year, pop in population.items()}
+    binned = []
+    for year in range(2010, 2021):
+        values = np.hstack([cube.daily(year)[:,None], 
+                    cube.daily(year, by='region'), 
+                    cube.daily(year, by='comuna')])
+        last = cube.last[cube.years.index(year)]
+        binned.append(bin_days(year, values, last, binsize=binsize))
+    past_dates, past_binwidths, past_values = zip(*binned[:-1])
+    past_mortality = np.array([v / population[y] 
+                            for y, v in zip(past_years, past_values)])
+    dates, binwidths, values = binned[-1]
+    mortality = values / population[2020]
+    if correction:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = mortality_rate_correction(past_years, past_binwidths, 
+                past_values, population=population)
+        # no trend for the comunas without past deaths
+        corr[~np.isfinite(corr)] = 1
+        past_mortality *= corr[:,None]
+    past = (past_dates, past_binwidths, past_mortality)
+    present = (dates, binwidths, mortality)
+    return zones, population, past, present
+
+def excess_table(vital='death', binsize=14, correction=True, 
+        start=EXCESS_START, update=True, cube=None):
+    # excess deaths in the country, each region and each comuna
+    if cube is None:
+        cube = build_chilean_vitals_cube(range(2010, 2021), vital=vital,
+            overwrite=[2020] if update else False)
+    tab, population, past, present = load_zone_vitals(cube, 
+            binsize=binsize, correction=correction)
+    past_dates, past_binwidths, past_mortality = past
+    begin, end, deaths, expected, excess, errinf, errsup = excess_deaths(
+            present, past_mortality, population[2020], start=start)
+    # first and last days of the bins (which start half a day before)
+    tab['begin'] = str((begin + HALFDAY).astype('datetime64[D]'))
+    tab['end'] = str((end - HALFDAY).astype('datetime64[D]'))
+    tab['deaths'] = deaths
+    tab['expected'] = expected
+    tab['excess'] = excess
+    tab['excess low'] = excess - errinf
+    tab['excess high'] = excess + errsup
+    for name in ['deaths', 'expected', 'excess', 'excess low', 
+            'excess high']:
+        tab[name].format = '.1f'
+    return tab
+
+def write_excess_table(filename, **kwargs):
+    tab = excess_table(**kwargs)
+    os.makedirs(OUTPUTDIR, exist_ok=True)
+    filename = os.path.join(OUTPUTDIR, filename)
+    print('Saving excess deaths to', filename)
+    tab.write(filename, format='ascii.csv', overwrite=True)
+    return tab
+
+def compare_this_year(vital='death', plot='', correction=True, binsize=14,
+        region=None, update=True, formats=FORMATS, dpi=None):
+    past, present = load_vital(vital=vital, region=region, 
+            correction=correction, binsize=binsize, update=update)
+    plot_vital(past, present, plotexcess=True, vital=vital, 
+            plotall=plot == 'all', region=region, formats=formats, dpi=dpi)
     return past, present
 
-past, present = compare_this_year(binsize=14)
+def binsize_type(binsize):
+    if binsize == 'month':
+        return binsize
+    return int(binsize)
+
+if __name__ == "__main__":
+    # figures are only saved to file, with localised month names
+    import matplotlib
+    matplotlib.use('Agg')
+    locale.setlocale(locale.LC_ALL, '')
+    parser = argparse.ArgumentParser(description=
+        'Compare the deaths in Chile this year with the ones of 2010-2019'
+    )
+    parser.add_argument('--binsize', type=binsize_type, default=14,
+        help='number of days binned together, or month'
+    )
+    parser.add_argument('--region', type=int, default=None,
+        help='region code (1-16), whole country if not given'
+    )
+    parser.add_argument('--no-correction', dest='correction', 
+        action='store_false', default=True,
+        help='do not correct past years from the secular mortality trend'
+    )
+    parser.add_argument('--all', action='store_true', default=False,
+        help='plot each of the past years'
+    )
+    parser.add_argument('--table', default=None,
+        help='write the excess deaths of the country, regions and comunas'
+             ' to this file of the output directory instead of plotting'
+    )
+    parser.add_argument('--no-update', dest='update', action='store_false',
+        default=True,
+        help='use the local data of this year even if they are not recent'
+    )
+    parser.add_argument('-f', '--format', dest='fmt', nargs='+',
+        default=FORMATS, choices=['png', 'pdf', 'svg'],
+        help='plot format(s) (pdf, png, or svg)',
+    )
+    parser.add_argument('--dpi', type=float, default=None,
+        help='resolution of raster formats'
+    )
+    arg = parser.parse_args()
+    if arg.table is not None:
+        write_excess_table(arg.table, binsize=arg.binsize, 
+            correction=arg.correction, update=arg.update)
+    else:
+        compare_this_year(binsize=arg.binsize, region=arg.region, 
+            correction=arg.correction, plot='all' if arg.all else '',
+            update=arg.update, formats=arg.fmt, dpi=arg.dpi)
 
@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+GRAPHICSDIR = 'graphics'
+FORMATS = ['png', 'pdf']
+RASTER_FORMATS = ['png']
+VECTOR_FORMATS = ['pdf', 'svg']
+
+def _savefig_dpi(fig, dpi=None):
+    import matplotlib
+    if dpi is None:
+        dpi = matplotlib.rcParams['savefig.dpi']
+    if dpi == 'figure':
+        dpi = fig.dpi
+    return dpi
+
+def _agg_compatible():
+    # render_raster ignores the savefig bounding box, padding and
+    # transparency, so savefig is needed if they are not the defaults
+    import matplotlib
+    rc = matplotlib.rcParams
+    return rc['savefig.bbox'] in [None, 'standard'] and not (
+                rc['savefig.transparent'])
+
+def render_raster(fig, dpi=None):
+    # RGBA pixels of the figure drawn by Agg with the savefig colours and
+    # resolution (see _agg_compatible for the other settings)
+    import matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    dpi = _savefig_dpi(fig, dpi)
+    canvas, fig_dpi = fig.canvas, fig.dpi
+    colors = fig.patch.get_facecolor(), fig.patch.get_edgecolor()
+    for color, set_color in zip(['facecolor', 'edgecolor'],
+            [fig.patch.set_facecolor, fig.patch.set_edgecolor]):
+        color = matplotlib.rcParams['savefig.' + color]
+        if color != 'auto':
+            set_color(color)
+    try:
+        agg = FigureCanvasAgg(fig)
+        fig.dpi = dpi
+        agg.draw()
+        pixels = np.array(agg.buffer_rgba())
+    finally:
+        fig.dpi = fig_dpi
+        fig.set_canvas(canvas)
+        fig.patch.set_facecolor(colors[0])
+        fig.patch.set_edgecolor(colors[1])
+    return pixels
+
+def output_formats(filename, formats=FORMATS):
+    # name and formats of an output file given with or without extension
+    name, ext = os.path.splitext(filename)
+    if ext[1:] in RASTER_FORMATS + VECTOR_FORMATS:
+        return name, [ext[1:]]
+    return filename, formats
+
+class FigureExport(object):
+    # writes each figure to several formats: raster ones are encoded from
+    # a single Agg render, in a pool of threads while the vector ones are
+    # drawn if jobs > 1
+    def __init__(self, formats=FORMATS, dpi=None, jobs=1,
+            directory=GRAPHICSDIR):
+        unknown = set(formats) - set(RASTER_FORMATS + VECTOR_FORMATS)
+        if unknown:
+            raise ValueError('unsupported format(s): {}'.format(
+                    ', '.join(sorted(unknown))))
+        self.formats = list(formats)
+        self.dpi = dpi
+        self.directory = directory
+        self._pool = ThreadPoolExecutor(jobs) if jobs > 1 else None
+        self._pending = []
+    def filenames(self, name):
+        return [os.path.join(self.directory, '{}.{}'.format(name, fmt))
+                    for fmt in self.formats]
+    def _submit(self, func, *args, **kwargs):
+        if self._pool is None:
+            func(*args, **kwargs)
+        else:
+            self._pending.append(self._pool.submit(func, *args, **kwargs))
+    def save(self, fig, name):
+        filenames = self.filenames(name)
+        os.makedirs(os.path.dirname(filenames[0]) or '.', exist_ok=True)
+        outputs = list(zip(filenames, self.formats))
+        raster = [(f, fmt) for f, fmt in outputs if fmt in RASTER_FORMATS]
+        if not _agg_compatible():
+            raster = []
+        if raster:
+            from matplotlib.image import imsave
+            dpi = _savefig_dpi(fig, self.dpi)
+            pixels = render_raster(fig, dpi)
+            for filename, fmt in raster:
+                self._submit(imsave, filename, pixels, format=fmt, dpi=dpi)
+        for filename, fmt in outputs:
+            if (filename, fmt) not in raster:
+                fig.savefig(filename, format=fmt, dpi=self.dpi)
+        return filenames
+    def close(self):
+        # wait for pending encodings, raising the first error
+        if self._pool is not None:
+            self._pool.shutdown()
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+def save_figure(fig, name, formats=FORMATS, dpi=None, jobs=2,
+        directory=GRAPHICSDIR):
+    with FigureExport(formats, dpi=dpi, jobs=jobs,
+            directory=directory) as export:
+        return export.save(fig, name)
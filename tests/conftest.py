@@ -0,0 +1,132 @@
+import datetime
+import email.message
+import http.server
+import io
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+# the modules are scripts at the root of the repository
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOTDIR)
+
+COUNTRIES = ['Chile', 'Peru']
+
+@pytest.fixture
+def international_table():
+    # growing random series in the layout of the international data set
+    from astropy.table import Table
+    rng = np.random.default_rng(0)
+    ndays = 60
+    start = datetime.date(2020, 3, 1).toordinal()
+    dates = [datetime.date.fromordinal(start + k).isoformat()
+                for k in range(ndays)]
+    tab = Table()
+    tab['date'] = np.tile(dates, len(COUNTRIES))
+    for var in ['cases', 'deaths', 'recoveries']:
+        tab[var] = rng.poisson(np.linspace(1, 200, len(tab)))
+    tab['country'] = np.repeat(COUNTRIES, ndays)
+    tab['region'] = np.full((len(tab),), 'all')
+    return tab
+
+# HTTP test doubles for the retrieval of input files
+
+CSV = 'a,b\n1,2\n3,4\n'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 01 Jun 2020 00:00:00 GMT'
+
+@pytest.fixture
+def inputdir(tmp_path, monkeypatch):
+    import datahandling
+    monkeypatch.setattr(datahandling, 'INPUTDIR', str(tmp_path))
+    datahandling.TABLE_CACHE.clear()
+    return tmp_path
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # serves server.files (path: content) over keep-alive connections, with
+    # 304 on a matching ETag, server.redirects (path: location) and
+    # server.failures (path: number of 503 answers before serving it)
+    protocol_version = 'HTTP/1.1'
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        self.server.clients.append(self.client_address)
+        if self.path in self.server.redirects:
+            self.send_response(302)
+            self.send_header('Location', self.server.redirects[self.path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.server.failures.get(self.path):
+            self.server.failures[self.path] -= 1
+            self.send_error(503)
+            return
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = content.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(data)
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.files = {'/data.csv': CSV}
+    httpd.redirects = {}
+    httpd.failures = {}
+    httpd.requests = []
+    httpd.clients = []
+    httpd.url = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+class FakeResponse(object):
+    # response of FakeTransport, failing after fail_after bytes if given
+    def __init__(self, status, data=b'', headers={}, fail_after=None):
+        self.status = status
+        self.headers = email.message.Message()
+        for key, value in headers.items():
+            self.headers[key] = value
+        self._data = io.BytesIO(data)
+        self._fail_after = fail_after
+    def read(self, size=-1):
+        if (self._fail_after is not None 
+                and self._data.tell() >= self._fail_after):
+            raise ConnectionResetError('connection lost')
+        return self._data.read(size)
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        pass
+
+class FakeTransport(object):
+    # answers with the queued responses and records the request headers
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+    def __call__(self, url, headers={}, log=print):
+        self.requests.append((url, dict(headers)))
+        return self.responses.pop(0)
+
+def ok_response(data=CSV, **kwargs):
+    return FakeResponse(200, data.encode('utf-8'), {'ETag': ETAG, 
+                'Last-Modified': LAST_MODIFIED, 
+                'Content-Type': 'text/csv; charset=utf-8'}, **kwargs)
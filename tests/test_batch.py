@@ -0,0 +1,80 @@
+import json
+import os
+import runpy
+import sys
+
+import pytest
+
+import compare_countries
+import datahandling
+from conftest import COUNTRIES
+
+@pytest.fixture
+def graphicsdir(tmp_path, monkeypatch, international_table):
+    # batches are run on a random table and saved to a temporary directory
+    tab = international_table
+    monkeypatch.setattr(datahandling, 'build_international_data_set',
+                lambda source='JohnHopkins': tab)
+    monkeypatch.setattr(compare_countries, 'build_international_data_set',
+                lambda source='JohnHopkins': tab)
+    monkeypatch.setattr(compare_countries, 'GRAPHICSDIR', str(tmp_path))
+    return tmp_path
+
+def write_batch(path, specs):
+    filename = os.path.join(str(path), 'batch.json')
+    with open(filename, 'w') as f:
+        json.dump(specs, f)
+    return filename
+
+DEFAULTS = dict(countries=COUNTRIES, variable='case', origin=10, nbin=7,
+        cum=False, logy=False, trend=False, lang='en', style='classic',
+        source='JohnHopkins', fmt=['png'], dpi=50)
+
+def test_failed_plot_does_not_stop_batch(graphicsdir):
+    specs = [{'logy': True}, {'countries': ['Atlantis']}, {'cum': True}]
+    plots = compare_countries.read_batch(write_batch(graphicsdir, specs),
+                DEFAULTS)
+    results = compare_countries.run_batch(plots)
+    (files, error), (_, failure), (cum_files, _) = results
+    assert error is None and os.path.exists(files[0])
+    assert 'Atlantis' in failure[0]
+    assert os.path.exists(cum_files[0])
+
+def test_batch_exit_status(graphicsdir, monkeypatch):
+    specs = [{'logy': True}, {'countries': ['Atlantis'], 'output': 'bad'}]
+    filename = write_batch(graphicsdir, specs)
+    # the script saves to its own graphics directory
+    monkeypatch.chdir(graphicsdir)
+    argv = ['compare_countries.py', '--batch', filename, '-f', 'png',
+            '--style', 'classic', '-c'] + COUNTRIES
+    monkeypatch.setattr(sys, 'argv', argv)
+    script = compare_countries.__file__
+    with pytest.raises(SystemExit) as status:
+        runpy.run_path(script, run_name='__main__')
+    assert status.value.code == 1
+    write_batch(graphicsdir, specs[:1])
+    with pytest.raises(SystemExit) as status:
+        runpy.run_path(script, run_name='__main__')
+    assert status.value.code == 0
+
+def test_batch_names_are_distinct(graphicsdir):
+    specs = [{}, {'countries': ['Chile']}, {'origin': 20}, {'lang': 'es'},
+             {'style': 'ggplot'}, {'trend': True}, {'variable': 'recovery'}]
+    plots = compare_countries.read_batch(write_batch(graphicsdir, specs),
+                DEFAULTS)
+    names = [plot['output'] for plot in plots]
+    assert len(set(names)) == len(names)
+    assert names[-1].startswith('covid-19-international-recoveries-')
+    results = compare_countries.run_batch(plots)
+    assert [error for files, error in results] == [None] * len(plots)
+    assert len(os.listdir(str(graphicsdir))) == len(plots) + 1
+
+@pytest.mark.parametrize('specs', [
+    [{}, {}],
+    [{'output': 'same'}, {'output': 'same.png', 'lang': 'es'}],
+    [{'fmt': ['png', 'pdf']}, {'fmt': 'pdf'}],
+])
+def test_batch_rejects_same_output(graphicsdir, specs):
+    with pytest.raises(ValueError, match='both saved'):
+        compare_countries.read_batch(write_batch(graphicsdir, specs),
+                DEFAULTS)
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+import numpy as np
+
+from conftest import ROOTDIR
+from datahandling import CountryResolver, COUNTRY_ALIASES
+
+def test_name_does_not_import_pycountry():
+    code = '''if True:
+        import sys
+        import numpy as np
+        from astropy.table import Table
+        from datahandling import get_country_data, COUNTRY_RESOLVER
+        tab = Table([['2020-03-01', '2020-03-02'], [1, 2], ['Chile'] * 2, 
+                    ['all'] * 2], names=['date', 'cases', 'country', 'region'])
+        assert get_country_data(tab, 'Chile', 'cases')[1].tolist() == [1, 2]
+        assert COUNTRY_RESOLVER.name('Korea, South') == 'South Korea'
+        print('pycountry' in sys.modules)'''
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOTDIR,
+                capture_output=True, text=True, check=True)
+    assert out.stdout.split() == ['False']
+
+def test_name_agrees_with_lookup():
+    countries = list(COUNTRY_ALIASES) + ['Chile', 'Atlantis']
+    names = [CountryResolver().name(c) for c in countries]
+    resolver = CountryResolver()
+    assert [resolver(c)[0] for c in countries] == names
+    assert [resolver.name(c) for c in countries] == names
+    assert names[:3] == ['United States', 'South Korea', 'Taiwan']
+    resolved, code2, code3, known = resolver.resolve(np.array(countries))
+    assert resolved.tolist() == names
+    assert known.tolist() == [True, True, True, True, False]
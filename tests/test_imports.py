@@ -0,0 +1,11 @@
+import pytest
+
+from benchmark import SCRIPTS, import_time
+
+# the import time budget is only checked by benchmark.py as timings vary
+# from machine to machine, but the modules deferred to where they are
+# used must never be imported with the scripts
+
+@pytest.mark.parametrize('module', SCRIPTS)
+def test_lazy_imports(module):
+    assert import_time(module)[1] == []
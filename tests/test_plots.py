@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+import datahandling
+from conftest import ROOTDIR, COUNTRIES
+
+# smoke tests: a log-scale figure of each plotting script is drawn and saved
+
+@pytest.fixture(autouse=True)
+def agg():
+    import matplotlib
+    from matplotlib import pyplot as plt
+    backend = matplotlib.get_backend()
+    plt.switch_backend('Agg')
+    with matplotlib.rc_context():
+        yield
+    plt.close('all')
+    plt.switch_backend(backend)
+
+def saved(directory):
+    return sorted(os.listdir(str(directory)))
+
+def test_compare_countries(tmp_path, international_table):
+    import compare_countries
+    from export import save_figure
+    fig = compare_countries.country_comparison_plot(international_table,
+                COUNTRIES, 'death', date_origin=10, logy=True)
+    assert fig.axes[0].get_yscale() == 'symlog'
+    save_figure(fig, 'compare', ['png'], directory=str(tmp_path))
+    assert saved(tmp_path) == ['compare.png']
+
+def test_country_stat(tmp_path, monkeypatch, international_table):
+    import country_stat
+    from export import save_figure
+    monkeypatch.setattr(country_stat, 'build_international_data_set',
+                lambda source='JohnHopkins': international_table)
+    fig = country_stat.plot_country(COUNTRIES[0], logy=True, binsize=1)
+    assert fig.axes[0].get_yscale() == 'symlog'
+    save_figure(fig, 'country', ['png'], directory=str(tmp_path))
+    assert saved(tmp_path) == ['country.png']
+
+def test_curacavi(tmp_path, monkeypatch):
+    # the script reads input/ and writes graphics/ in the working directory
+    import curacavi
+    os.symlink(os.path.join(ROOTDIR, 'input'), str(tmp_path / 'input'))
+    monkeypatch.chdir(tmp_path)
+    curacavi.grafica_curacavi(plot_log=True, show=False, formats=['png'])
+    assert saved(tmp_path / 'graphics') == ['curacavi.png']
+
+def test_chilean_cases_by_comuna(tmp_path, monkeypatch):
+    import chilean_cases_by_comuna as comunas
+    monkeypatch.setattr(comunas, 'GRAPHICSDIR', str(tmp_path))
+    monkeypatch.setattr(datahandling, 'INPUTDIR',
+                os.path.join(ROOTDIR, 'input'))
+    tabs = datahandling.read_chilean_region(13, None)
+    figs = comunas.plot_region(13, 'comunas.pdf', tabs=tabs, template=True)
+    assert figs[0].axes[0].get_yscale() == 'symlog'
+    assert saved(tmp_path) == ['comunas.pdf']
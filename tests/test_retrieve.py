@@ -0,0 +1,105 @@
+import hashlib
+import os
+import urllib.error
+
+import pytest
+
+import datahandling
+from datahandling import retrieve_table
+from conftest import CSV, ETAG, LAST_MODIFIED
+from conftest import FakeResponse, FakeTransport, ok_response
+
+def test_download_writes_file_and_metadata(inputdir):
+    transport = FakeTransport(ok_response())
+    tab = retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+                transport=transport)
+    assert tab['a'].tolist() == [1, 3]
+    local = os.path.join(inputdir, 'data.csv')
+    with open(local) as fh:
+        assert fh.read() == CSV
+    metadata = datahandling._read_metadata(local)
+    assert metadata['url'] == 'http://x/data.csv'
+    assert metadata['etag'] == ETAG
+    assert metadata['last_modified'] == LAST_MODIFIED
+    assert metadata['sha256'] == hashlib.sha256(CSV.encode()).hexdigest()
+    assert 'checked' in metadata
+    assert transport.requests[0][1] == {}
+
+def test_recent_file_is_not_downloaded(inputdir):
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(ok_response()))
+    transport = FakeTransport()
+    tab = retrieve_table('http://x/data.csv', 'data.csv', max_time=3600,
+                transport=transport)
+    assert transport.requests == []
+    assert len(tab) == 2
+
+def test_not_modified_reuses_local_file(inputdir):
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(ok_response()))
+    local = os.path.join(inputdir, 'data.csv')
+    checked = datahandling._read_metadata(local)['checked']
+    transport = FakeTransport(FakeResponse(304))
+    tab = retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+                transport=transport)
+    headers = transport.requests[0][1]
+    assert headers['If-None-Match'] == ETAG
+    assert headers['If-Modified-Since'] == LAST_MODIFIED
+    assert tab['b'].tolist() == [2, 4]
+    metadata = datahandling._read_metadata(local)
+    assert metadata['etag'] == ETAG
+    assert metadata['checked'] >= checked
+
+def test_changed_local_file_drops_validators(inputdir):
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(ok_response()))
+    local = os.path.join(inputdir, 'data.csv')
+    with open(local, 'w') as fh:
+        fh.write('a,b\n0,0\n')
+    transport = FakeTransport(ok_response())
+    tab = retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+                transport=transport)
+    assert transport.requests[0][1] == {}
+    assert tab['a'].tolist() == [1, 3]
+
+def test_other_url_drops_validators(inputdir):
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(ok_response()))
+    transport = FakeTransport(ok_response())
+    retrieve_table('http://y/data.csv', 'data.csv', max_time=0,
+        transport=transport)
+    assert transport.requests[0][1] == {}
+
+def test_encoding_is_converted_to_utf8(inputdir):
+    text = 'a,b\nñ,é\n'
+    response = FakeResponse(200, text.encode('latin-1'), 
+                    {'Content-Type': 'text/csv; charset=latin-1'})
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(response))
+    with open(os.path.join(inputdir, 'data.csv'), encoding='utf-8') as fh:
+        assert fh.read() == text
+
+def test_http_download_then_not_modified(inputdir, server):
+    url = server.url + '/data.csv'
+    tab = retrieve_table(url, 'data.csv', max_time=0)
+    assert tab['a'].tolist() == [1, 3]
+    assert 'If-None-Match' not in server.requests[0][1]
+    local = os.path.join(inputdir, 'data.csv')
+    mtime = os.path.getmtime(local)
+    tab = retrieve_table(url, 'data.csv', max_time=0)
+    assert server.requests[1][1]['If-None-Match'] == ETAG
+    assert os.path.getmtime(local) == mtime
+    assert tab['b'].tolist() == [2, 4]
+
+def test_http_error_keeps_old_file(inputdir, server):
+    url = server.url + '/data.csv'
+    retrieve_table(url, 'data.csv', max_time=0)
+    del server.files['/data.csv']
+    local = os.path.join(inputdir, 'data.csv')
+    # a changed file, so that the request is not conditional
+    with open(local, 'a') as fh:
+        fh.write('5,6\n')
+    with pytest.raises(urllib.error.HTTPError):
+        retrieve_table(url, 'data.csv', max_time=0)
+    with open(local) as fh:
+        assert fh.read() == CSV + '5,6\n'
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import datahandling
+from datahandling import retrieve_table
+from conftest import CSV, FakeTransport, ok_response
+
+def test_download_leaves_no_partial_file(inputdir):
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(ok_response()))
+    local = os.path.join(inputdir, 'data.csv')
+    with open(local) as fh:
+        assert fh.read() == CSV
+    assert not os.path.exists(local + '.part')
+
+def test_failed_transfer_keeps_old_file(inputdir):
+    retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+        transport=FakeTransport(ok_response()))
+    local = os.path.join(inputdir, 'data.csv')
+    metadata = datahandling._read_metadata(local)
+    new = 'a,b\n' + '5,6\n' * 100000
+    transport = FakeTransport(ok_response(new, fail_after=1 << 16))
+    with pytest.raises(ConnectionResetError):
+        retrieve_table('http://x/data.csv', 'data.csv', max_time=0,
+            transport=transport, default_encoding='utf-8')
+    with open(local) as fh:
+        assert fh.read() == CSV
+    assert datahandling._read_metadata(local) == metadata
+    assert not os.path.exists(local + '.part')
+
+def test_unwritable_partial_file_keeps_error(inputdir, monkeypatch):
+    # the partial file cannot be created: its error is the one raised
+    def denied(*args, **kwargs):
+        raise PermissionError('denied')
+    monkeypatch.setattr(datahandling, 'open', denied, raising=False)
+    with pytest.raises(PermissionError):
+        datahandling._stream_to_file(ok_response(), 
+            os.path.join(inputdir, 'data.csv'), 'utf-8')
@@ -0,0 +1,135 @@
+import datetime
+
+import numpy as np
+import pytest
+from astropy.table import Table
+
+import timeseries
+from datahandling import get_country_data
+
+SEEDS = range(8)
+START = datetime.date(2020, 1, 22).toordinal()
+
+def random_values(seed, nzones=12, ndays=60, monotone=True):
+    # zone × day daily numbers, with zones that stay at zero, start late or
+    # have bursts; negative daily numbers (revisions) if not monotone
+    rng = np.random.default_rng(seed)
+    rates = rng.exponential(20, size=(nzones, 1))
+    values = rng.poisson(rates * np.ones((1, ndays)))
+    values[0] = 0
+    start = rng.integers(0, ndays, size=nzones)
+    values[np.arange(ndays) < start[:,None]] = 0
+    burst = rng.random(values.shape) < 0.05
+    values[burst] *= 10
+    if not monotone:
+        values -= rng.poisson(rates / 2 * np.ones((1, ndays)))
+    return values
+
+def long_table(values):
+    # the layout of the international data set for these zones
+    nzones, ndays = values.shape
+    dates = [datetime.date.fromordinal(START + k).isoformat()
+                for k in range(ndays)]
+    countries = ['Zone {}'.format(k) for k in range(nzones)]
+    tab = Table()
+    tab['date'] = np.tile(dates, nzones)
+    tab['cases'] = values.ravel()
+    tab['country'] = np.repeat(countries, ndays)
+    tab['region'] = np.full((nzones * ndays,), 'all')
+    return tab, countries, START + np.arange(ndays)
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_cumulated(seed):
+    values = random_values(seed)
+    tab, countries, days = long_table(values)
+    cum = timeseries.cumulated(values)
+    for k, country in enumerate(countries):
+        dates, ref = get_country_data(tab, country, 'cases', cum=True)
+        assert np.array_equal(dates, days)
+        assert np.array_equal(cum[k], ref)
+
+@pytest.mark.parametrize('seed', SEEDS)
+@pytest.mark.parametrize('nbin', [2, 3, 7, 14])
+def test_binned(seed, nbin):
+    values = random_values(seed, monotone=seed % 2)
+    tab, countries, days = long_table(values)
+    binned = timeseries.binned(values, nbin)
+    for k, country in enumerate(countries):
+        dates, ref = get_country_data(tab, country, 'cases', nbin=nbin)
+        assert np.array_equal(dates, days[nbin-1:])
+        assert np.array_equal(binned[k], ref)
+
+@pytest.mark.parametrize('seed', SEEDS)
+@pytest.mark.parametrize('n', [1, 4, 7])
+def test_rolling(seed, n):
+    values = random_values(seed, monotone=False)
+    sums = np.array([[v[j:j+n].sum() for j in range(len(v) - n + 1)]
+                        for v in values])
+    assert np.array_equal(timeseries.rolling_sum(values, n), sums)
+    assert np.allclose(timeseries.rolling_mean(values, n), sums / n)
+    assert np.array_equal(timeseries.rolling_sum(values[0], n), sums[0])
+
+@pytest.mark.parametrize('seed', SEEDS)
+@pytest.mark.parametrize('origin', [0.5, 50.5, 400.5, 1e9])
+@pytest.mark.parametrize('nbin', [1, 7])
+def test_alignment_on_monotone_series(seed, origin, nbin):
+    # thresholds between integers, as np.interp is ambiguous on plateaus
+    values = random_values(seed)
+    tab, countries, days = long_table(values)
+    cum = timeseries.cumulated(values)
+    crossing = timeseries.crossing_days(cum, origin, days)
+    aligned = timeseries.days_since(cum, origin, days)
+    binned = timeseries.binned(values, nbin)
+    for k, country in enumerate(countries):
+        dates, ref = get_country_data(tab, country, 'cases', nbin=nbin,
+                            date_origin=origin)
+        if not len(dates):
+            assert cum[k].max() < origin
+            assert np.isnan(crossing[k]) and np.isnan(aligned[k]).all()
+            continue
+        assert np.isclose(crossing[k], np.interp(origin, cum[k], days))
+        assert np.allclose(aligned[k,nbin-1:], dates, rtol=0, atol=1e-9)
+        if nbin > 1:
+            assert np.array_equal(binned[k], ref)
+
+def test_alignment_on_non_monotone_series():
+    # a series crossing 50 on day 0.5 and revised back under it: the kernel
+    # takes the first crossing where np.interp in get_country_data, which
+    # assumes increasing values, gives the last day
+    values = np.array([[0, 100, -80, 0, 0]])
+    tab, countries, days = long_table(values)
+    cum = timeseries.cumulated(values)
+    crossing = timeseries.crossing_days(cum, 50, days)
+    assert crossing[0] == days[0] + 0.5
+    aligned = timeseries.days_since(cum, 50, days)
+    assert np.array_equal(aligned[0], np.arange(len(days)) - 0.5)
+    dates, ref = get_country_data(tab, countries[0], 'cases', date_origin=50)
+    assert np.array_equal(dates, np.arange(len(days)) - (len(days) - 1))
+
+def test_crossing_before_first_day_and_never():
+    cum = np.array([[100, 200, 300], [0, 10, 20], [0, 0, 50]])
+    crossing = timeseries.crossing_days(cum, 50)
+    assert crossing[0] == 0
+    assert np.isnan(crossing[1])
+    assert crossing[2] == 2
+
+@pytest.mark.parametrize('seed', SEEDS)
+@pytest.mark.parametrize('n', [3, 4, 7])
+def test_doubling_times(seed, n):
+    rng = np.random.default_rng(seed)
+    nzones, ndays = 5, 30
+    growth = rng.normal(0, 0.2, size=(nzones, 1))
+    values = 100 * np.exp(growth * np.arange(ndays)
+                    + rng.normal(0, 0.05, size=(nzones, ndays)))
+    values[0,10] = 0
+    days = START + np.arange(ndays)
+    doubling = timeseries.doubling_times(values, n, days)
+    assert doubling.shape == (nzones, ndays - n + 1)
+    for k in range(nzones):
+        for j in range(ndays - n + 1):
+            window = values[k,j:j+n]
+            if (window <= 0).any():
+                assert np.isnan(doubling[k,j])
+                continue
+            slope = np.polyfit(days[j:j+n], np.log2(window), 1)[0]
+            assert np.isclose(doubling[k,j], 1 / slope, rtol=1e-6)
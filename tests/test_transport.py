@@ -0,0 +1,100 @@
+import os
+import urllib.error
+
+import pytest
+
+from datahandling import retrieve_table, retrieve_tables, HTTPTransport
+from conftest import CSV, ETAG, FakeTransport
+
+def test_download_then_not_modified(inputdir, server):
+    transport = HTTPTransport()
+    url = server.url + '/data.csv'
+    tab = retrieve_table(url, 'data.csv', max_time=0, transport=transport)
+    assert tab['a'].tolist() == [1, 3]
+    assert 'If-None-Match' not in server.requests[0][1]
+    local = os.path.join(inputdir, 'data.csv')
+    mtime = os.path.getmtime(local)
+    tab = retrieve_table(url, 'data.csv', max_time=0, transport=transport)
+    assert server.requests[1][1]['If-None-Match'] == ETAG
+    assert os.path.getmtime(local) == mtime
+    assert tab['b'].tolist() == [2, 4]
+
+def test_http_error_keeps_old_file(inputdir, server):
+    transport = HTTPTransport(retries=0)
+    url = server.url + '/data.csv'
+    retrieve_table(url, 'data.csv', max_time=0, transport=transport)
+    del server.files['/data.csv']
+    local = os.path.join(inputdir, 'data.csv')
+    # a changed file, so that the request is not conditional
+    with open(local, 'a') as fh:
+        fh.write('5,6\n')
+    with pytest.raises(urllib.error.HTTPError):
+        retrieve_table(url, 'data.csv', max_time=0, transport=transport)
+    with open(local) as fh:
+        assert fh.read() == CSV + '5,6\n'
+
+def test_retrieve_tables_keeps_order_and_messages(inputdir, capsys):
+    files = ['t{}.csv'.format(k) for k in range(8)]
+    for k, name in enumerate(files):
+        with open(os.path.join(inputdir, name), 'w') as fh:
+            fh.write('a\n{}\n'.format(k))
+    tabs = retrieve_tables([dict(url='http://x/' + name, local=name)
+                                for name in files], transport=FakeTransport())
+    assert [tab['a'][0] for tab in tabs] == list(range(8))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ['Read data from recent file ' + 
+                        os.path.join(str(inputdir), name) for name in files]
+
+def test_connection_is_kept_alive(server):
+    transport = HTTPTransport()
+    for k in range(3):
+        with transport(server.url + '/data.csv') as response:
+            assert response.read() == CSV.encode()
+    assert len(set(server.clients)) == 1
+    transport.close()
+    with transport(server.url + '/data.csv') as response:
+        response.read()
+    assert len(set(server.clients)) == 2
+    transport.close()
+
+def test_retries_are_logged(server, capsys):
+    server.failures['/data.csv'] = 2
+    messages = []
+    with HTTPTransport(backoff=0) as transport:
+        response = transport(server.url + '/data.csv', 
+                        log=lambda *args: messages.append(args))
+        assert response.read() == CSV.encode()
+    assert [args[0] for args in messages] == ['Retry download from'] * 2
+    assert capsys.readouterr().out == ''
+
+def test_retrieve_tables_prints_retries_in_order(inputdir, server, capsys):
+    files = ['t{}.csv'.format(k) for k in range(6)]
+    for k, name in enumerate(files):
+        server.files['/' + name] = 'a\n{}\n'.format(k)
+        server.failures['/' + name] = 1
+    transport = HTTPTransport(backoff=0.01)
+    tabs = retrieve_tables([dict(url=server.url + '/' + name, local=name,
+                                max_time=0) for name in files], 
+                transport=transport)
+    assert [tab['a'][0] for tab in tabs] == list(range(6))
+    lines = capsys.readouterr().out.splitlines()
+    for k, name in enumerate(files):
+        url = server.url + '/' + name
+        assert lines[2*k].startswith('Download recent data from ' + url)
+        assert lines[2*k+1].startswith('Retry download from ' + url)
+    # the connections of the pool threads are closed with it
+    assert transport._connections == {}
+
+def test_redirects_are_followed(inputdir, server):
+    server.redirects['/old.csv'] = '/data.csv'
+    tab = retrieve_table(server.url + '/old.csv', 'data.csv', max_time=0,
+                transport=HTTPTransport())
+    assert tab['a'].tolist() == [1, 3]
+
+def test_too_many_redirects(inputdir, server):
+    server.redirects['/loop.csv'] = '/loop.csv'
+    with pytest.raises(urllib.error.HTTPError, match='redirects'):
+        retrieve_table(server.url + '/loop.csv', 'data.csv', max_time=0,
+            transport=HTTPTransport(max_redirects=3))
+    assert len(server.requests) == 4
+    assert not os.path.exists(os.path.join(inputdir, 'data.csv'))
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+
+# Numeric kernels on zone × day arrays: every function works along the
+# last axis, so that all the zones are processed at once (1-D arrays are
+# a single zone).
+
+import numpy as np
+
+def cumulated(values):
+    return np.cumsum(values, axis=-1)
+
+def rolling_sum(values, n):
+    # sums over the windows of n days ending on days n - 1, n, ..., last
+    values = np.asarray(values)
+    cum = np.cumsum(values, axis=-1)
+    sums = cum[...,n-1:].copy()
+    sums[...,1:] -= cum[...,:-n]
+    return sums
+
+def rolling_mean(values, n):
+    return rolling_sum(values, n) / n
+
+def binned(values, n):
+    # new cases over the last n days as in get_country_data: the first
+    # bin only holds day n - 1
+    sums = rolling_sum(values, n)
+    sums[...,0] = np.asarray(values)[...,n-1]
+    return sums
+
+def crossing_days(cumulated, threshold, days=None):
+    # (fractional) day when each cumulated series first reaches threshold,
+    # linearly interpolated; NaN if it never does
+    cumulated = np.atleast_2d(np.asarray(cumulated, dtype=float))
+    nzones, ndays = cumulated.shape
+    if days is None:
+        days = np.arange(ndays)
+    days = np.broadcast_to(np.asarray(days, dtype=float), cumulated.shape)
+    threshold = np.broadcast_to(threshold, (nzones,))
+    above = cumulated > threshold[:,None]
+    # last day below or at threshold before the first day above it
+    j = np.where(above.any(axis=1), above.argmax(axis=1), ndays) - 1
+    j0 = np.clip(j, 0, ndays - 1)
+    j1 = np.clip(j + 1, 0, ndays - 1)
+    zone = np.arange(nzones)
+    c0, c1 = cumulated[zone,j0], cumulated[zone,j1]
+    d0, d1 = days[zone,j0], days[zone,j1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(c1 != c0, (threshold - c0) / (c1 - c0), 0)
+    crossing = d0 + frac * (d1 - d0)
+    crossing[j < 0] = days[j < 0,0]
+    reached = cumulated.max(axis=1) >= threshold
+    return np.where(reached, crossing, np.nan)
+
+def days_since(cumulated, threshold, days=None):
+    # days counted from the threshold crossing of each series (zone × day),
+    # NaN for the series not reaching it
+    cumulated = np.atleast_2d(cumulated)
+    if days is None:
+        days = np.arange(cumulated.shape[-1])
+    origin = crossing_days(cumulated, threshold, days)
+    return np.asarray(days, dtype=float) - origin[:,None]
+
+def doubling_times(values, n, days=None):
+    # doubling times (negative when halving) from log2-linear least squares
+    # fits on the rolling windows of n days; NaN for non-positive values
+    values = np.asarray(values, dtype=float)
+    if days is None:
+        days = np.arange(values.shape[-1])
+    days = np.broadcast_to(np.asarray(days, dtype=float), values.shape)
+    # non-positive values are zeroed and their windows flagged afterwards,
+    # as a NaN would propagate through the cumulated sums to later windows
+    positive = values > 0
+    y = np.log2(np.where(positive, values, 1))
+    # windows are shifted to start at day zero to avoid cancellations
+    x = days - days[...,:1]
+    sx, sy = rolling_sum(x, n), rolling_sum(y, n)
+    sxx, sxy = rolling_sum(x * x, n), rolling_sum(x * y, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        doubling = 1 / slope
+    doubling[rolling_sum(~positive, n) > 0] = np.nan
+    return doubling
@@ -3,10 +3,8 @@
 import os
 import re
 import numpy as np
-from astropy.io import ascii
-from matplotlib import pylab as plt
-from matplotlib.dates import MO, WeekdayLocator, DateFormatter
 from datahandling import read_time_series
+from export import save_figure, FORMATS
 
 def plot_date(axis, x, y, label, *a, **ka):
     line = axis.plot(x, y, *a, **ka)[0]
@@ -15,7 +13,9 @@ def plot_date(axis, x, y, label, *a, **ka):
     axis.tick_params(axis='y', colors=color)
     # ax.spines['right'].set_color(color)
 
-def plot_tests(style=None, show=True, save=True):
+def plot_tests(style=None, show=True, save=True, formats=FORMATS, dpi=None):
+    from matplotlib import pyplot as plt
+    from matplotlib.dates import MO, WeekdayLocator, DateFormatter
 
     cols = [0, -2]
     test_d, test_t = read_time_series(17, header_lines=2, columns=cols)
@@ -80,8 +80,9 @@ def plot_tests(style=None, show=True, save=True):
         fig.show()
 
     if save:
-        fig.savefig('graphics/casos-chile.png')    
-        fig.savefig('graphics/casos-chile.pdf')    
+        save_figure(fig, 'casos-chile', formats, dpi=dpi)
 
 if __name__ == "__main__":
+    import matplotlib
+    matplotlib.use('Agg')
     plot_tests(style='fivethirtyeight', show=False, save=True)
@@ -1,10 +1,9 @@
-from astropy.io import ascii
 import numpy as np
 
-from datahandling import read_time_series
+from datahandling import read_time_series, read_table
 
 def get_population(region=None, sex=None, age=None, years=slice(2002,2036)):
-    tab = ascii.read('input/population.csv')
+    tab = read_table('input/population.csv')
     keep = np.ones((len(tab,)), dtype=bool)
     if region is not None:
         keep *= region == tab['Region']